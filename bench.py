@@ -0,0 +1,237 @@
+import argparse
+import functools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+import course as course_mod
+import gen
+import lt
+import sim
+
+# open wavy course of n segments: straight, arc to the left, straight, arc to the right, ...
+def wave_course(n, seed=0):
+    rng = np.random.default_rng(seed)
+    c = course_mod.Course()
+    c.set_start_point(np.array([0., 0.]))
+    c.try_add_line_segment(np.array([0.3, 0.]))
+    c.append_segment()
+    sign = 1
+    while len(c.segments) < n:
+        last = c.segments[-1]
+        c.set_start_point(None)
+        if last['type'] == 'lineseg':
+            d = last['end-dir']
+            normal = np.array([-d[1], d[0]])
+            c.try_add_curve_segment(last['end'] + d * rng.uniform(0.1, 0.3) + sign * normal * rng.uniform(0.05, 0.15))
+            sign = -sign
+        else:
+            c.try_add_line_segment(last['end'] + last['end-dir'] * rng.uniform(0.1, 0.5))
+        c.append_segment()
+    return c
+
+# points near the course centerline
+def near_points(c, n, seed=0):
+    rng = np.random.default_rng(seed)
+    starts = c.tables.line_start
+    return starts[rng.integers(len(starts), size=n)] + rng.normal(0, c.lw2, (n, 2))
+
+# seconds per call: best of `repeat` rounds of about min_time each
+def timeit(fn, min_time=0.2, repeat=3):
+    n = 1
+    while True:
+        t = time.perf_counter()
+        for _ in range(n):
+            fn()
+        dt = time.perf_counter() - t
+        if dt >= min_time / 10:
+            break
+        n *= 10
+    n = max(1, int(min_time * n / dt))
+    best = float('inf')
+    for _ in range(repeat):
+        t = time.perf_counter()
+        for _ in range(n):
+            fn()
+        best = min(best, (time.perf_counter() - t) / n)
+    return best, n
+
+# suites map benchmark names to setup functions returning the callable to time,
+# so fixtures are only built for the benchmarks that run (see --filter)
+
+# fixtures shared between setups
+cached_wave_course = functools.lru_cache(wave_course)
+cached_generate = functools.lru_cache(gen.generate)
+
+def bench_sample(results, quick):
+    for n_seg in ([10, 100] if quick else [10, 100, 1000, 10000]):
+        for n_pts in [1, 8, 64, 1024]:
+            def setup(n_seg=n_seg, n_pts=n_pts):
+                c = cached_wave_course(n_seg)
+                pts = near_points(c, n_pts)
+                return lambda: c.sample(pts)
+            results[f"course.sample/seg={n_seg}/pts={n_pts}"] = setup
+
+# closed generated courses, to see how sample() scales with course size
+def bench_generated(results, quick):
+    for n_seg in ([1000] if quick else [1000, 100000]):
+        def setup(n_seg=n_seg):
+            c = cached_generate(n_seg)
+            pts = near_points(c, 64)
+            return lambda: c.sample(pts)
+        results[f"course.sample/gen={n_seg}/pts=64"] = setup
+
+def bench_model(results, quick):
+    def step():
+        m = lt.LTModel()
+        return lambda: m.step(0.2, 0.5, 0.01)
+    results["model.step"] = step
+    results["model.update_sensor_pos"] = lambda: lt.LTModel().update_sensor_pos
+
+@functools.lru_cache
+def warm_controller():
+    s = sim.Simulator(cached_wave_course(100))
+    for _ in range(50):
+        s.step()
+    return s.controller
+
+def bench_controller(results, quick):
+    def add_sample():
+        ctrl = warm_controller()
+        far = np.array([1e3, 1e3])
+        def fn():
+            # a sample far away, so every call appends
+            ctrl.samples.append(far)
+            ctrl.add_sample()
+        return fn
+    results["controller.add_sample"] = add_sample
+    def pi():
+        ctrl = warm_controller()
+        return lambda: ctrl.pi(0.2)
+    results["controller.pi"] = pi
+    def pos2vel():
+        ctrl = warm_controller()
+        ctrl.I = 0
+        return lambda: ctrl.pos2vel(np.array([1., 0.]), np.zeros(2), np.zeros(2), 0.01)
+    results["controller.pos2vel"] = pos2vel
+
+@functools.lru_cache
+def viewer(scale=100):
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import graphic
+    return graphic.Viewer(scale=scale)
+
+def draw_batch(n_seg):
+    import graphic
+    return graphic.cmds_to_batch(cached_wave_course(n_seg).draw_course())
+
+def bench_viewer(results, quick):
+    for n_seg in ([100] if quick else [100, 1000]):
+        def draw(n_seg=n_seg):
+            v = viewer()
+            cmds = cached_wave_course(n_seg).draw_course()
+            def fn():
+                v.clear()
+                v.draw(cmds)
+            return fn
+        results[f"viewer.draw/seg={n_seg}"] = draw
+        def batched(n_seg=n_seg):
+            v = viewer()
+            batch = draw_batch(n_seg)
+            def fn():
+                v.clear()
+                v.draw(batch)
+            return fn
+        results[f"viewer.draw_batch/seg={n_seg}"] = batched
+    # zoomed in on the middle of the last course: nearly everything is culled
+    def draw_zoomed(n_seg=n_seg):
+        v = viewer(scale=100 * 64)
+        batch = draw_batch(n_seg)
+        p = cached_wave_course(n_seg).segments[n_seg // 2]['start']
+        v.offset = [-v.scale * p[0] / v.screen_size[0], v.scale * p[1] / v.screen_size[1]]
+        def fn():
+            v.clear()
+            v.draw(batch)
+        return fn
+    results[f"viewer.draw_batch/seg={n_seg}/zoom=64"] = draw_zoomed
+
+def bench_headless(results, quick):
+    for n_seg in ([100] if quick else [100, 1000]):
+        def setup(n_seg=n_seg):
+            s = sim.Simulator(cached_wave_course(n_seg))
+            # losing the line restarts from here, controller included
+            start = s.checkpoint()
+            def step():
+                try:
+                    s.step()
+                except AssertionError:
+                    s.restore(start)
+            return step
+        results[f"sim.step/seg={n_seg}"] = setup
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def cold_import(modules):
+    subprocess.run([sys.executable, '-c', f"import {', '.join(modules)}"], cwd=HERE, check=True, capture_output=True)
+
+# fresh interpreter + import, what every process pool worker pays
+def bench_startup(results, quick):
+    results["startup/python"] = lambda: lambda: cold_import(['sys'])
+    results["startup/core"] = lambda: lambda: cold_import(['sim', 'course'])
+    results["startup/graphic"] = lambda: lambda: cold_import(['graphic'])
+
+SUITES = [bench_sample, bench_generated, bench_model, bench_controller, bench_viewer, bench_headless, bench_startup]
+
+def run(args):
+    fns = {}
+    for suite in SUITES:
+        suite(fns, args.quick)
+    out = {}
+    for name, setup in fns.items():
+        if args.filter and args.filter not in name:
+            continue
+        per_call, n = timeit(setup(), min_time=args.min_time)
+        out[name] = {'per_call': per_call, 'calls_per_s': 1 / per_call, 'n': n}
+        print(f"{name:40s} {per_call * 1e6:12.2f} us  {1 / per_call:12.1f} /s", file=sys.stderr)
+    return {'meta': {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(), 'time': time.time()},
+            'results': out}
+
+# ratio new/baseline per benchmark; regressions are ratios above threshold
+def compare(new, base, threshold):
+    regressions = []
+    for name, r in sorted(new['results'].items()):
+        if name not in base['results']:
+            continue
+        ratio = r['per_call'] / base['results'][name]['per_call']
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f"{name:40s} {ratio:6.2f}x{flag}", file=sys.stderr)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark the simulation hot paths")
+    parser.add_argument('--out', default=None, help="write results as json")
+    parser.add_argument('--compare', default=None, help="baseline json to compare against")
+    parser.add_argument('--threshold', type=float, default=1.25, help="slowdown ratio counted as regression")
+    parser.add_argument('--filter', default=None)
+    parser.add_argument('--min-time', type=float, default=0.2)
+    parser.add_argument('--quick', action='store_true')
+    args = parser.parse_args(argv)
+
+    result = run(args)
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=1)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            base = json.load(f)
+        if compare(result, base, args.threshold):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,7 @@
 import numpy as np
 import sys
+import os
+import hashlib
 import yaml
 from pprint import pprint
 
@@ -14,12 +16,12 @@ def check_on_line(pos, start, end, d):
     ld = np.linalg.norm(vecp - lv * v)
     return ld <= d
 
-def check_on_arc(pos, origin, r, d, start_vec, end_vec):
+# arc covers the ccw angle range start_th -> end_th
+def check_on_arc(pos, origin, r, d, start_th, end_th):
     v = pos - origin
     x = np.linalg.norm(v)
-    #print(np.cross(start_vec, v), np.cross(end_vec, v))
-    #print("x,d,r,", r-d, x, r+d, r-d < x and x < r+d)
-    if np.cross(start_vec, v) >= 0 and np.cross(end_vec, v) <= 0:
+    th = np.arctan2(v[1], v[0])
+    if (th - start_th) % (2 * np.pi) <= (end_th - start_th) % (2 * np.pi):
         return r-d < x and x < r+d
     return False
 
@@ -48,6 +50,57 @@ def check_on_circle(pos, origin, r):
     x = np.linalg.norm(pos - origin)
     return x <= r
 
+# vectorized versions: broadcast over leading axes, e.g. points[:, None] against
+# (M,) primitives -> (N, M), or row-aligned (point, primitive) pairs -> (P,)
+def check_on_lines(points, starts, v, l, d):
+    vecp = points - starts
+    lv = vecp[..., 0] * v[..., 0] + vecp[..., 1] * v[..., 1]
+    ld = np.linalg.norm(vecp - lv[..., None] * v, axis=-1)
+    return (lv >= 0) & (lv <= l) & (ld <= d)
+
+def check_on_arcs(points, origins, r, d, start_th, end_th):
+    v = points - origins
+    x = np.linalg.norm(v, axis=-1)
+    th = np.arctan2(v[..., 1], v[..., 0])
+    inside = (th - start_th) % (2 * np.pi) <= (end_th - start_th) % (2 * np.pi)
+    return inside & (r - d < x) & (x < r + d)
+
+def check_on_circles(points, origins, r):
+    x = np.linalg.norm(points - origins, axis=-1)
+    return x <= r
+
+# signed clearance: > 0 where the matching check_on_* is true, 0 on its boundary
+def clearance_lines(points, starts, v, l, d):
+    vecp = points - starts
+    lv = vecp[..., 0] * v[..., 0] + vecp[..., 1] * v[..., 1]
+    ld = np.linalg.norm(vecp - lv[..., None] * v, axis=-1)
+    return np.minimum(d - ld, np.minimum(lv, l - lv))
+
+def clearance_arcs(points, origins, r, d, start_th, end_th):
+    v = points - origins
+    x = np.linalg.norm(v, axis=-1)
+    span = (end_th - start_th) % (2 * np.pi)
+    a = (np.arctan2(v[..., 1], v[..., 0]) - start_th) % (2 * np.pi)
+    ang = np.where(a <= span, np.minimum(a, span - a), -np.minimum(a - span, 2 * np.pi - a))
+    return np.minimum(d - np.abs(x - r), ang * x)
+
+def clearance_circles(points, origins, r):
+    return r - np.linalg.norm(points - origins, axis=-1)
+
+# distance to the centerline of each segment
+def distance_lines(points, starts, v, l):
+    vecp = points - starts
+    lv = np.clip(vecp[..., 0] * v[..., 0] + vecp[..., 1] * v[..., 1], 0, l)
+    return np.linalg.norm(vecp - lv[..., None] * v, axis=-1)
+
+def distance_arcs(points, origins, r, start_th, end_th, starts, ends):
+    v = points - origins
+    th = np.arctan2(v[..., 1], v[..., 0])
+    inside = (th - start_th) % (2 * np.pi) <= (end_th - start_th) % (2 * np.pi)
+    d = np.where(inside, np.abs(np.linalg.norm(v, axis=-1) - r), np.inf)
+    d = np.minimum(d, np.linalg.norm(points - starts, axis=-1))
+    return np.minimum(d, np.linalg.norm(points - ends, axis=-1))
+
 def circle_pos_vec_to_dir_vec(v, ccw=True):
     ret = np.array([-v[1], v[0]])
     l = np.linalg.norm(ret)
@@ -56,67 +109,515 @@ def circle_pos_vec_to_dir_vec(v, ccw=True):
     else:
         return -ret / l
 
+# bounding box of the arc band r-d..r+d over the ccw angle range th0 -> th1
+# arc_bbox over (N,) arcs, (N, 2) lo and hi
+def arc_bboxes(origin, r, d, th0, th1):
+    span = (th1 - th0) % (2 * np.pi)
+    ends = np.stack([th0, th0 + span], axis=1)
+    u = np.stack([np.cos(ends), np.sin(ends)], axis=2) # (N, 2 ends, 2)
+    ps = np.concatenate([u * (r + d)[:, None, None], u * np.maximum(r - d, 0)[:, None, None]], axis=1)
+    lo = ps.min(axis=1)
+    hi = ps.max(axis=1)
+    # band reaches r + d along +x, +y, -x, -y when the arc sweeps through them
+    through = (np.arange(4) * np.pi / 2 - th0[:, None]) % (2 * np.pi) <= span[:, None]
+    hi = np.where(through[:, :2], (r + d)[:, None], hi)
+    lo = np.where(through[:, 2:], -(r + d)[:, None], lo)
+    return origin + lo, origin + hi
+
+def arc_bbox(origin, r, d, th0, th1):
+    lo = th0
+    hi = th0 + (th1 - th0) % (2 * np.pi)
+    ths = [lo, hi] + [k * np.pi / 2 for k in range(int(np.ceil(lo / (np.pi / 2))), int(np.floor(hi / (np.pi / 2))) + 1)]
+    ths = np.array(ths)
+    u = np.stack([np.cos(ths), np.sin(ths)], axis=1)
+    ps = np.concatenate([u * (r + d), u[:2] * max(r - d, 0)])
+    return origin + ps.min(axis=0), origin + ps.max(axis=0)
+
+# Course.distance scans every segment up to this many, the grid is slower below
+DISTANCE_SCAN_MAX = 512
+
+LINESEG = 0
+ARCSEG = 1
+
+# on-disk cache of compiled yaml courses, keyed by file hash
+CACHE_DIR = os.environ.get('LT_COURSE_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'lt'))
+NPZ_VERSION = 1
+
+def to_plain(v):
+    if isinstance(v, dict):
+        return {k: to_plain(x) for k, x in v.items()}
+    if isinstance(v, (list, tuple)):
+        return [to_plain(x) for x in v]
+    if isinstance(v, np.ndarray):
+        return v.tolist()
+    if isinstance(v, np.generic):
+        return v.item()
+    return v
+
+def from_plain(seg):
+    return {k: np.array(v, dtype=float) if isinstance(v, list) else v for k, v in seg.items()}
+
+# struct-of-arrays form of segments/marks, compiled from the editable dicts
+class CourseTables():
+    def __init__(self, segments, marks):
+        lines = [seg for seg in segments if seg['type'] == 'lineseg']
+        arcs = [seg for seg in segments if seg['type'] == 'arcseg']
+        self.seg_type = np.array([LINESEG if seg['type'] == 'lineseg' else ARCSEG for seg in segments], dtype=np.int8)
+        self.seg_row = np.zeros(len(segments), dtype=np.int64)
+        self.seg_row[self.seg_type == LINESEG] = np.arange(len(lines))
+        self.seg_row[self.seg_type == ARCSEG] = np.arange(len(arcs))
+
+        self.line_start = np.array([seg['start'] for seg in lines], dtype=float).reshape(-1, 2)
+        self.line_end = np.array([seg['end'] for seg in lines], dtype=float).reshape(-1, 2)
+        vecl = self.line_end - self.line_start
+        self.line_len = np.linalg.norm(vecl, axis=1)
+        self.line_dir = vecl / self.line_len[:, None]
+
+        self.arc_origin = np.array([seg['origin'] for seg in arcs], dtype=float).reshape(-1, 2)
+        self.arc_r = np.array([seg['r'] for seg in arcs], dtype=float)
+        self.arc_start = np.array([seg['start'] for seg in arcs], dtype=float).reshape(-1, 2)
+        self.arc_end = np.array([seg['end'] for seg in arcs], dtype=float).reshape(-1, 2)
+        self.arc_start_dir = np.array([seg['start-dir'] for seg in arcs], dtype=float).reshape(-1, 2)
+        self.arc_end_dir = np.array([seg['end-dir'] for seg in arcs], dtype=float).reshape(-1, 2)
+        self.arc_start_th = np.array([seg['start-th'] for seg in arcs], dtype=float)
+        self.arc_end_th = np.array([seg['end-th'] for seg in arcs], dtype=float)
+
+        self.mark_origin = np.array([mark['origin'] for mark in marks], dtype=float).reshape(-1, 2)
+        self.mark_r = np.array([mark['r'] for mark in marks], dtype=float)
+
+    ARRAYS = ['seg_type', 'seg_row',
+              'line_start', 'line_end', 'line_len', 'line_dir',
+              'arc_origin', 'arc_r', 'arc_start', 'arc_end', 'arc_start_dir', 'arc_end_dir', 'arc_start_th', 'arc_end_th',
+              'mark_origin', 'mark_r']
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        self = cls.__new__(cls)
+        for k in cls.ARRAYS:
+            setattr(self, k, arrays[k])
+        return self
+
+    def to_arrays(self):
+        return {k: getattr(self, k) for k in self.ARRAYS}
+
+    def to_segments(self):
+        segments = []
+        for t, i in zip(self.seg_type, self.seg_row):
+            if t == LINESEG:
+                segments.append({"type":"lineseg", "start":self.line_start[i], "end":self.line_end[i], "start-dir":self.line_dir[i], "end-dir":self.line_dir[i]})
+            else:
+                segments.append({"type":"arcseg", "origin":self.arc_origin[i], "r":float(self.arc_r[i]), "start":self.arc_start[i], "end":self.arc_end[i],
+                                 "start-dir":self.arc_start_dir[i], "end-dir":self.arc_end_dir[i],
+                                 "start-th":float(self.arc_start_th[i]), "end-th":float(self.arc_end_th[i])})
+        return segments
+
+    def to_marks(self):
+        return [{"origin":o, "r":float(r)} for o, r in zip(self.mark_origin, self.mark_r)]
+
+    # seg_pairs/mark_pairs: (point index, segment/mark index) candidate pairs
+    def sample(self, points, seg_pairs, mark_pairs, lw2):
+        ob = np.zeros(len(points), dtype=bool)
+        pidx, sidx = seg_pairs
+        types = self.seg_type[sidx]
+        rows = self.seg_row[sidx]
+        sel = types == LINESEG
+        if sel.any():
+            p, i = pidx[sel], rows[sel]
+            ob[p[check_on_lines(points[p], self.line_start[i], self.line_dir[i], self.line_len[i], lw2)]] = True
+        sel = types == ARCSEG
+        if sel.any():
+            p, i = pidx[sel], rows[sel]
+            ob[p[check_on_arcs(points[p], self.arc_origin[i], self.arc_r[i], lw2, self.arc_start_th[i], self.arc_end_th[i])]] = True
+        p, i = mark_pairs
+        if len(p) > 0:
+            ob[p[check_on_circles(points[p], self.mark_origin[i], self.mark_r[i])]] = True
+        return ob
+
+    # max clearance over the candidate pairs, -inf for points without candidates
+    def clearance(self, points, seg_pairs, mark_pairs, lw2):
+        ret = np.full(len(points), -np.inf)
+        pidx, sidx = seg_pairs
+        types = self.seg_type[sidx]
+        rows = self.seg_row[sidx]
+        sel = types == LINESEG
+        if sel.any():
+            p, i = pidx[sel], rows[sel]
+            np.maximum.at(ret, p, clearance_lines(points[p], self.line_start[i], self.line_dir[i], self.line_len[i], lw2))
+        sel = types == ARCSEG
+        if sel.any():
+            p, i = pidx[sel], rows[sel]
+            np.maximum.at(ret, p, clearance_arcs(points[p], self.arc_origin[i], self.arc_r[i], lw2, self.arc_start_th[i], self.arc_end_th[i]))
+        p, i = mark_pairs
+        if len(p) > 0:
+            np.maximum.at(ret, p, clearance_circles(points[p], self.mark_origin[i], self.mark_r[i]))
+        return ret
+
+    def length(self):
+        spans = (self.arc_end_th - self.arc_start_th) % (2 * np.pi)
+        return self.line_len.sum() + (self.arc_r * spans).sum()
+
+    # distance from each point to the nearest centerline, (N,); checks every segment
+    def distance(self, points):
+        ds = [np.full(len(points), np.inf)]
+        p = points[:, None, :]
+        if len(self.line_len) > 0:
+            ds.append(distance_lines(p, self.line_start, self.line_dir, self.line_len).min(axis=1))
+        if len(self.arc_r) > 0:
+            ds.append(distance_arcs(p, self.arc_origin, self.arc_r, self.arc_start_th, self.arc_end_th, self.arc_start, self.arc_end).min(axis=1))
+        return np.min(ds, axis=0)
+
+    # same over (point index, segment index) candidate pairs only, inf without any
+    def distance_pairs(self, points, seg_pairs):
+        ret = np.full(len(points), np.inf)
+        pidx, sidx = seg_pairs
+        types = self.seg_type[sidx]
+        rows = self.seg_row[sidx]
+        sel = types == LINESEG
+        if sel.any():
+            p, i = pidx[sel], rows[sel]
+            np.minimum.at(ret, p, distance_lines(points[p], self.line_start[i], self.line_dir[i], self.line_len[i]))
+        sel = types == ARCSEG
+        if sel.any():
+            p, i = pidx[sel], rows[sel]
+            np.minimum.at(ret, p, distance_arcs(points[p], self.arc_origin[i], self.arc_r[i], self.arc_start_th[i], self.arc_end_th[i], self.arc_start[i], self.arc_end[i]))
+        return ret
+
+# one int64 per grid cell (ix, iy); cell_xy inverts it
+def cell_codes(ix, iy):
+    return (ix << 32) | (iy & 0xffffffff)
+
+def cell_xy(codes):
+    return codes >> 32, ((codes & 0xffffffff) ^ 0x80000000) - 0x80000000
+
+# uniform grid of buckets; each key is stored in every cell its bbox overlaps.
+# build() fills it in bulk as sorted arrays (cell codes + CSR keys), the first
+# insert/remove after that turns them into the editable dicts
+class GridIndex():
+    def __init__(self, cell=0.1):
+        self.cell = cell
+        self.clear()
+
+    def clear(self):
+        self.cells = {}
+        self.ranges = {}
+        self.codes = None
+
+    def insert(self, key, lo, hi):
+        self.thaw()
+        i0 = np.floor(np.asarray(lo) / self.cell).astype(int)
+        i1 = np.floor(np.asarray(hi) / self.cell).astype(int)
+        self.ranges[key] = (i0, i1)
+        for ix in range(i0[0], i1[0] + 1):
+            for iy in range(i0[1], i1[1] + 1):
+                self.cells.setdefault((ix, iy), []).append(key)
+
+    # replaces the contents with (N,) keys of (N, 2) bboxes lo..hi, no per-key python
+    def build(self, keys, lo, hi):
+        self.clear()
+        i0 = np.floor(np.asarray(lo) / self.cell).astype(np.int64).reshape(-1, 2)
+        i1 = np.floor(np.asarray(hi) / self.cell).astype(np.int64).reshape(-1, 2)
+        if len(i0) == 0:
+            return
+        self.built = (np.asarray(keys, dtype=np.int64), i0, i1)
+        # one (cell, key) row per covered cell, grouped by cell
+        ny = i1[:, 1] - i0[:, 1] + 1
+        n = (i1[:, 0] - i0[:, 0] + 1) * ny
+        k = np.repeat(np.arange(len(n)), n)
+        j = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        codes = cell_codes(i0[k, 0] + j // ny[k], i0[k, 1] + j % ny[k])
+        keys = self.built[0][k]
+        order = np.lexsort((keys, codes))
+        codes = codes[order]
+        first = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        self.codes = codes[first]
+        self.offsets = np.r_[first, len(codes)]
+        self.keys = keys[order]
+
+    # built arrays -> dicts, as if every key had been insert()ed
+    def thaw(self):
+        if self.codes is None:
+            return
+        keys, i0, i1 = self.built
+        self.ranges = dict(zip(keys.tolist(), zip(i0, i1)))
+        ks = self.keys.tolist()
+        ix, iy = cell_xy(self.codes)
+        cells = zip(ix.tolist(), iy.tolist())
+        self.cells = {c: ks[a:b] for c, a, b in zip(cells, self.offsets[:-1].tolist(), self.offsets[1:].tolist())}
+        self.codes = None
+
+    def remove(self, key):
+        self.thaw()
+        if key not in self.ranges:
+            return
+        i0, i1 = self.ranges.pop(key)
+        for ix in range(i0[0], i1[0] + 1):
+            for iy in range(i0[1], i1[1] + 1):
+                bucket = self.cells[(ix, iy)]
+                bucket.remove(key)
+                if len(bucket) == 0:
+                    del self.cells[(ix, iy)]
+
+    # (point index, key) for every key in the cell of every point
+    def query_pairs(self, points):
+        ids = np.floor(points / self.cell).astype(np.int64)
+        if self.codes is not None:
+            return self.query_built(cell_codes(ids[:, 0], ids[:, 1]))
+        _, first, inv = np.unique(cell_codes(ids[:, 0], ids[:, 1]), return_index=True, return_inverse=True)
+        uniq = ids[first]
+        inv = inv.reshape(-1)
+        buckets = [self.cells.get((ix, iy), ()) for ix, iy in uniq.tolist()]
+        counts = np.array([len(b) for b in buckets], dtype=np.int64)
+        keys = np.fromiter((k for b in buckets for k in b), dtype=np.int64, count=counts.sum())
+        first = np.cumsum(counts) - counts
+        n = counts[inv]
+        pidx = np.repeat(np.arange(len(points)), n)
+        kpos = np.repeat(first[inv] - (np.cumsum(n) - n), n) + np.arange(n.sum())
+        return pidx, keys[kpos]
+
+    def query_built(self, codes):
+        pos = np.minimum(np.searchsorted(self.codes, codes), len(self.codes) - 1)
+        hit = self.codes[pos] == codes
+        start = self.offsets[pos]
+        n = np.where(hit, self.offsets[pos + 1] - start, 0)
+        pidx = np.repeat(np.arange(len(codes)), n)
+        kpos = np.repeat(start - (np.cumsum(n) - n), n) + np.arange(n.sum())
+        return pidx, self.keys[kpos]
+
 class Course():
     # list of (carvature = 1/R, length) <=> delta_theta = length / R
-    def __init__(self, lw = 0.019, cm=0.02, mark_d=0.06):
+    def __init__(self, lw = 0.019, cm=0.02, mark_d=0.06, grid_cell=0.1):
         self.lw2 = lw/2.
         self.cm2 = cm/2.
         self.mark_d = mark_d
-        self.segments = []
+        self._segments = []
+        self._marks = []
         self.popped = []
-        self.marks = []
         self.current_seg = None
         self.current_pos = None
-
-    def load(self, filepath):
-        with open(filepath, 'r') as f:
-            d = yaml.safe_load(f)
-            self.lw2 = d['lw2']
-            self.cm2 = d['cm2']
-            self.mark_d = d['md']
-            self.segments = d['segments']
-            self.marks = d['marks']
-            self.current_seg = None
+        self.seg_index = GridIndex(grid_cell)
+        self.mark_index = GridIndex(grid_cell)
+        self.version = 0
+        self._tables = None
+        self._digest = None
+        self.raster = None # optional raster.OccupancyMap used by sample()
+        # draw commands of the committed segments/marks, kept in step with the
+        # edits; None means rebuild on the next draw_segments()
+        self.seg_cmds = None
+        self.seg_ncmds = None
+        self.mark_cmds = None
+
+    # must be called whenever segments or marks change
+    def changed(self):
+        if self._segments is None or self._marks is None:
+            self._segments = self.segments
+            self._marks = self.marks
+        self.version += 1
+        self._tables = None
+        self._digest = None
+        self.raster = None
+
+    @property
+    def tables(self):
+        if self._tables is None:
+            self._tables = CourseTables(self.segments, self.marks)
+        return self._tables
+
+    # segments/marks are materialized from the tables on first access after load_npz
+    @property
+    def segments(self):
+        if self._segments is None:
+            self._segments = self._tables.to_segments()
+        return self._segments
+
+    @segments.setter
+    def segments(self, segments):
+        self._segments = segments
+        self.seg_cmds = None
+
+    @property
+    def marks(self):
+        if self._marks is None:
+            self._marks = self._tables.to_marks()
+        return self._marks
+
+    @marks.setter
+    def marks(self, marks):
+        self._marks = marks
+        self.mark_cmds = None
+
+    def index_segment(self, i):
+        seg = self.segments[i]
+        if seg['type'] == 'lineseg':
+            lo = np.minimum(seg['start'], seg['end']) - self.lw2
+            hi = np.maximum(seg['start'], seg['end']) + self.lw2
+        elif seg['type'] == 'arcseg':
+            lo, hi = arc_bbox(seg['origin'], seg['r'], self.lw2, seg['start-th'], seg['end-th'])
+        else:
+            return
+        self.seg_index.insert(i, lo, hi)
+
+    def unindex_segment(self, i):
+        self.seg_index.remove(i)
+
+    # call after replacing segments/marks wholesale
+    def reindex(self):
+        self.changed()
+        self.seg_index.clear()
+        self.mark_index.clear()
+        for i in range(len(self.segments)):
+            self.index_segment(i)
+        for i, mark in enumerate(self.marks):
+            self.mark_index.insert(i, np.asarray(mark['origin']) - mark['r'], np.asarray(mark['origin']) + mark['r'])
+
+    # same as reindex() but from the compiled tables, without touching the dicts
+    def index_tables(self):
+        t = self.tables
+        lo = np.zeros((len(t.seg_type), 2))
+        hi = np.zeros((len(t.seg_type), 2))
+        lines = t.seg_type == LINESEG
+        rows = t.seg_row[lines]
+        lo[lines] = np.minimum(t.line_start[rows], t.line_end[rows]) - self.lw2
+        hi[lines] = np.maximum(t.line_start[rows], t.line_end[rows]) + self.lw2
+        arcs = t.seg_type == ARCSEG
+        rows = t.seg_row[arcs]
+        lo[arcs], hi[arcs] = arc_bboxes(t.arc_origin[rows], t.arc_r[rows], self.lw2, t.arc_start_th[rows], t.arc_end_th[rows])
+        self.seg_index.build(np.arange(len(t.seg_type)), lo, hi)
+        r = t.mark_r[:, None]
+        self.mark_index.build(np.arange(len(t.mark_r)), t.mark_origin - r, t.mark_origin + r)
+
+    def load(self, filepath, use_cache=True):
+        if filepath.endswith('.npz'):
+            self.load_npz(filepath)
+            return
+        with open(filepath, 'rb') as f:
+            data = f.read()
+        cache_path = None
+        if use_cache:
+            digest = hashlib.sha1(data + b'npz%d' % NPZ_VERSION).hexdigest()
+            cache_path = os.path.join(CACHE_DIR, digest + '.npz')
+            if os.path.exists(cache_path):
+                self.load_npz(cache_path)
+                return
+        d = yaml.safe_load(data)
+        self.lw2 = d['lw2']
+        self.cm2 = d['cm2']
+        self.mark_d = d['md']
+        self.segments = [from_plain(seg) for seg in d['segments']]
+        self.marks = [from_plain(mark) for mark in d['marks']]
+        self.current_seg = None
+        self.popped = []
+        self.reindex()
+        if cache_path is not None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            tmp = f"{cache_path}.{os.getpid()}.tmp.npz"
+            self.save_npz(tmp)
+            os.replace(tmp, cache_path)
 
     def save(self, filepath):
+        if filepath.endswith('.npz'):
+            self.save_npz(filepath)
+            return
         d = {}
         d['lw2'] = self.lw2
         d['cm2'] = self.cm2
         d['md'] = self.mark_d
-        d['segments'] = self.segments
-        d['marks'] = self.marks
+        d['segments'] = to_plain(self.segments)
+        d['marks'] = to_plain(self.marks)
         with open(filepath, 'w') as f:
             yaml.dump(d, f, default_flow_style=False, allow_unicode=True)
 
+    def load_npz(self, filepath):
+        with np.load(filepath, allow_pickle=False) as z:
+            arrays = {k: z[k] for k in z.files}
+        assert int(arrays['version']) == NPZ_VERSION
+        self.lw2 = float(arrays['lw2'])
+        self.cm2 = float(arrays['cm2'])
+        self.mark_d = float(arrays['md'])
+        self.changed()
+        self._tables = CourseTables.from_arrays(arrays)
+        self._segments = None
+        self._marks = None
+        self.seg_cmds = None
+        self.mark_cmds = None
+        self.current_seg = None
+        self.popped = []
+        self.index_tables()
+
+    def save_npz(self, filepath):
+        np.savez(filepath, version=NPZ_VERSION, lw2=self.lw2, cm2=self.cm2, md=self.mark_d, **self.tables.to_arrays())
+
     def draw_course(self):
-        dos = []
-        for o in self.segments:
-            if o['type'] == 'arcseg':
-                dos = dos + graphic.draw_arcseg_cmd(o['origin'], o['r'], o['start-th'], o['end-th'])
-            elif o['type'] == 'lineseg':
-                dos = dos + graphic.draw_lineseg_cmd(o['start'], o['end'])
-        if self.current_seg is not None:
-            o = self.current_seg
-            if o['type'] == 'arcseg':
-                dos = dos + graphic.draw_arcseg_cmd(o['origin'], o['r'], o['start-th'], o['end-th'], color=(255, 200, 200))
-            elif o['type'] == 'lineseg':
-                dos = dos + graphic.draw_lineseg_cmd(o['start'], o['end'], color=(200, 200, 250))
-        for o in self.marks:
-            dos = dos + graphic.draw_circle_cmd(o['origin'], o['r'], width=0, color=(180, 180, 180))
-        return dos
+        return self.draw_segments() + self.draw_preview()
+
+    # committed segments and marks; only changes with self.version
+    def draw_segments(self):
+        if self.seg_cmds is None:
+            self.seg_cmds = []
+            self.seg_ncmds = []
+            for o in self.segments:
+                self.draw_push_segment(o)
+        if self.mark_cmds is None:
+            self.mark_cmds = []
+            for o in self.marks:
+                self.mark_cmds.extend(self.mark_cmd(o))
+        return self.seg_cmds + self.mark_cmds
+
+    # segment being edited; the only part rebuilt per mouse move
+    def draw_preview(self):
+        if self.current_seg is None:
+            return []
+        o = self.current_seg
+        return self.segment_cmd(o, color=(255, 200, 200) if o['type'] == 'arcseg' else (200, 200, 250))
+
+    # drawing lives in render, loaded on first use
+    def segment_cmd(self, o, color=None):
+        import render
+        return render.segment_cmd(o, color)
+
+    def mark_cmd(self, o):
+        import render
+        return render.mark_cmd(o)
+
+    # keep seg_cmds in step with the segment list; no-ops until the first draw
+    def draw_push_segment(self, o):
+        if self.seg_cmds is not None:
+            cmds = self.segment_cmd(o)
+            self.seg_cmds.extend(cmds)
+            self.seg_ncmds.append(len(cmds))
+
+    def draw_pop_segment(self):
+        if self.seg_cmds is not None:
+            n = self.seg_ncmds.pop()
+            del self.seg_cmds[len(self.seg_cmds) - n:]
+
+    def draw_update_segment(self, i):
+        if self.seg_cmds is not None:
+            k = sum(self.seg_ncmds[:i])
+            cmds = self.segment_cmd(self.segments[i])
+            self.seg_cmds[k:k + self.seg_ncmds[i]] = cmds
+            self.seg_ncmds[i] = len(cmds)
 
     def push(self):
         if self.current_seg is not None:
             self.segments.append(self.current_seg)
+            self.index_segment(len(self.segments) - 1)
+            self.draw_push_segment(self.current_seg)
+            self.changed()
             self.current_seg = None
 
     def undo(self):
         if len(self.segments) > 0:
             self.popped.append(self.segments.pop())
+            self.unindex_segment(len(self.segments))
+            self.draw_pop_segment()
+            self.changed()
 
     def redo(self):
         if len(self.popped) > 0:
             self.segments.append(self.popped.pop())
+            self.index_segment(len(self.segments) - 1)
+            self.draw_push_segment(self.segments[-1])
+            self.changed()
 
     def debug(self):
         print("segments")
@@ -130,6 +631,8 @@ class Course():
         self.segments = []
         self.current_seg = None
         self.current_pos = None
+        self.seg_index.clear()
+        self.changed()
 
     def set_start_point(self, point):
         if len(self.segments) == 0:
@@ -198,9 +701,20 @@ class Course():
     def append_segment(self):
         if self.current_seg is not None:
             self.segments.append(self.current_seg)
+            self.index_segment(len(self.segments) - 1)
+            self.draw_push_segment(self.current_seg)
+            self.changed()
         self.current_pos = None
         self.current_seg = None
 
+    def add_mark(self, origin, r=None):
+        r = self.cm2 if r is None else r
+        self.marks.append({"origin": np.asarray(origin, dtype=float), "r": r})
+        self.mark_index.insert(len(self.marks) - 1, self.marks[-1]['origin'] - r, self.marks[-1]['origin'] + r)
+        if self.mark_cmds is not None:
+            self.mark_cmds.extend(self.mark_cmd(self.marks[-1]))
+        self.changed()
+
     def try_close_loop_with_arc_line(self):
         if len(self.segments) < 2:
             return
@@ -225,27 +739,56 @@ class Course():
 
     def close_loop(self):
         self.segments[0]["start"] = self.segments[-1]["end"]
-
-    def sample(self, points):
-        ob = []
-        for p in points:
-            ret = False
-            for seg in self.segments:
-                if seg['type'] == 'lineseg':
-                    ret = check_on_line(p, seg['start'], seg['end'], self.lw2)
-                elif seg['type'] == 'arcseg':
-                    ret = check_on_arc(p, seg['origin'], seg['r'], self.lw2, seg['start-dir'], seg['end-dir'])
-                if ret:
-                    break
-            if not ret:
-                for mark in self.marks:
-                    ret = check_on_circle(p, mark['origin'], mark['r'])
-                    if ret:
-                        break
-            ob.append(ret)
-
-        return ob
-
+        self.unindex_segment(0)
+        self.index_segment(0)
+        self.draw_update_segment(0)
+        self.changed()
+
+    # exact=True: the geometry even when a raster is attached (e.g. to build or check one)
+    def sample(self, points, exact=False):
+        if self.raster is not None and not exact:
+            return self.raster.sample(points)
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        return self.tables.sample(points, self.seg_index.query_pairs(points), self.mark_index.query_pairs(points), self.lw2)
+
+    # signed distance-like margin to the nearest line/mark edge, >= 0 where sample() is true
+    def clearance(self, points):
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        return self.tables.clearance(points, self.seg_index.query_pairs(points), self.mark_index.query_pairs(points), self.lw2)
+
+    def length(self):
+        return self.tables.length()
+
+    # sha1 of the compiled geometry; identifies the course in sim checkpoints
+    def digest(self):
+        if self._digest is None:
+            h = hashlib.sha1()
+            for k, v in self.tables.to_arrays().items():
+                h.update(k.encode())
+                h.update(np.ascontiguousarray(v).tobytes())
+            self._digest = h.digest()
+        return self._digest
+
+    # cross-track error: distance to the nearest segment. small courses are
+    # scanned whole; otherwise candidates come from the 3x3 cells around each
+    # point: a segment missing from all of them is farther than the block's
+    # border, so they settle every point whose nearest candidate is closer;
+    # the rest (far off the course) fall back to the full scan
+    def distance(self, points):
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if len(self.tables.seg_type) <= DISTANCE_SCAN_MAX:
+            return self.tables.distance(points)
+        cell = self.seg_index.cell
+        offsets = cell * np.array([(i, j) for i in (-1, 0, 1) for j in (-1, 0, 1)], dtype=float)
+        pidx, sidx = self.seg_index.query_pairs((points[None, :, :] + offsets[:, None, :]).reshape(-1, 2))
+        d = self.tables.distance_pairs(points, (pidx % len(points), sidx))
+        f = points / cell
+        f = f - np.floor(f)
+        border = cell * (1 + np.minimum(f, 1 - f).min(axis=1))
+        far = d > border
+        if far.any():
+            d[far] = self.tables.distance(points[far])
+        return d
 
 if __name__ == '__main__':
     import graphic
@@ -292,6 +835,7 @@ if __name__ == '__main__':
     while True:
         viewer.clear()
         viewer.handle_event(event_handler)
-        viewer.draw(course.draw_course())
+        viewer.set_static(course.version, course.draw_segments)
+        viewer.draw(course.draw_preview())
         viewer.flush(30)
 
@@ -0,0 +1,178 @@
+import numpy as np
+
+# draw commands as plain data (numpy only, no pygame): the draw_*_cmd dict
+# lists and DrawBatch. graphic.Viewer draws them, render builds them
+
+def draw_circle_cmd(p, r, color=None, width=0, name="-"):
+    return [{"type": "circle", "color":color, "origin":(p[0], p[1]), "r":r, "width":width, "name":name}]
+
+def draw_lineseg_cmd(p0, p1, color=None, width=1, name="-"):
+    return [{"type": "lineseg", "color":color, "start":(p0[0], p0[1]), "end":(p1[0], p1[1]), "width":width, "name":name}]
+
+def draw_arcseg_cmd(p, r, th0, th1, color=None, width=1, name="-"):
+    return [{"type": "arcseg", "color":color, "origin":(p[0], p[1]), "r":r, "start":th0, "end": th1, "width":width, "name":name}]
+
+def draw_poly_cmd(ps, color=None, width=1, name="-"):
+    return [{"type": "poly", "color":color, "points":ps, "width":width, "name":name}]
+
+def draw_eqtri_cmd(p, r, th, color=None, width=1, name="-"):
+    p0 = (p[0] + r * np.cos(th),             p[1] + r * np.sin(th))
+    p1 = (p[0] + r * np.cos(th + 2*np.pi/3), p[1] + r * np.sin(th + 2*np.pi/3))
+    p2 = (p[0] + r * np.cos(th + 4*np.pi/3), p[1] + r * np.sin(th + 4*np.pi/3))
+    return draw_poly_cmd([p0, p1, p2], color, width, name)
+
+# batched commands: one struct-of-arrays per primitive type, colors as (N, 3).
+# drawn polys first, then lines, arcs and circles
+class DrawBatch():
+    def __init__(self):
+        self.circle_origin = np.zeros((0, 2))
+        self.circle_r = np.zeros(0)
+        self.circle_width = np.zeros(0, dtype=int)
+        self.circle_color = np.zeros((0, 3), dtype=int)
+        self.line_start = np.zeros((0, 2))
+        self.line_end = np.zeros((0, 2))
+        self.line_width = np.zeros(0, dtype=int)
+        self.line_color = np.zeros((0, 3), dtype=int)
+        self.arc_origin = np.zeros((0, 2))
+        self.arc_r = np.zeros(0)
+        self.arc_th0 = np.zeros(0)
+        self.arc_th1 = np.zeros(0)
+        self.arc_width = np.zeros(0, dtype=int)
+        self.arc_color = np.zeros((0, 3), dtype=int)
+        self.poly_points = np.zeros((0, 2)) # all vertices, polygon i is poly_offsets[i]:poly_offsets[i+1]
+        self.poly_offsets = np.zeros(1, dtype=int)
+        self.poly_width = np.zeros(0, dtype=int)
+        self.poly_color = np.zeros((0, 3), dtype=int)
+
+    FIELDS = ['circle_origin', 'circle_r', 'circle_width', 'circle_color',
+              'line_start', 'line_end', 'line_width', 'line_color',
+              'arc_origin', 'arc_r', 'arc_th0', 'arc_th1', 'arc_width', 'arc_color',
+              'poly_points', 'poly_width', 'poly_color']
+
+    def __len__(self):
+        return len(self.circle_r) + len(self.line_width) + len(self.arc_r) + len(self.poly_width)
+
+    def __add__(self, other):
+        return DrawBatch.concat([self, other])
+
+    @staticmethod
+    def concat(batches):
+        ret = DrawBatch()
+        for k in DrawBatch.FIELDS:
+            setattr(ret, k, np.concatenate([getattr(b, k) for b in batches]))
+        sizes = np.concatenate([np.diff(b.poly_offsets) for b in batches])
+        ret.poly_offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(int)
+        return ret
+
+def batch_colors(color, n):
+    if isinstance(color, np.ndarray) and color.ndim == 2:
+        return color.astype(int)
+    return np.tile(np.array(s2color(color), dtype=int), (n, 1))
+
+def circle_batch(origins, r, color=None, width=0):
+    b = DrawBatch()
+    b.circle_origin = np.asarray(origins, dtype=float).reshape(-1, 2)
+    n = len(b.circle_origin)
+    b.circle_r = np.broadcast_to(np.asarray(r, dtype=float), (n,))
+    b.circle_width = np.broadcast_to(np.asarray(width, dtype=int), (n,))
+    b.circle_color = batch_colors(color, n)
+    return b
+
+def lineseg_batch(starts, ends, color=None, width=1):
+    b = DrawBatch()
+    b.line_start = np.asarray(starts, dtype=float).reshape(-1, 2)
+    b.line_end = np.asarray(ends, dtype=float).reshape(-1, 2)
+    n = len(b.line_start)
+    b.line_width = np.broadcast_to(np.asarray(width, dtype=int), (n,))
+    b.line_color = batch_colors(color, n)
+    return b
+
+def arcseg_batch(origins, r, th0, th1, color=None, width=1):
+    b = DrawBatch()
+    b.arc_origin = np.asarray(origins, dtype=float).reshape(-1, 2)
+    n = len(b.arc_origin)
+    b.arc_r = np.broadcast_to(np.asarray(r, dtype=float), (n,))
+    b.arc_th0 = np.broadcast_to(np.asarray(th0, dtype=float), (n,))
+    b.arc_th1 = np.broadcast_to(np.asarray(th1, dtype=float), (n,))
+    b.arc_width = np.broadcast_to(np.asarray(width, dtype=int), (n,))
+    b.arc_color = batch_colors(color, n)
+    return b
+
+# polys: sequence of (K_i, 2) vertex arrays
+def poly_batch(polys, color=None, width=0):
+    b = DrawBatch()
+    polys = [np.asarray(p, dtype=float).reshape(-1, 2) for p in polys]
+    b.poly_points = np.concatenate(polys) if polys else np.zeros((0, 2))
+    b.poly_offsets = np.concatenate([[0], np.cumsum([len(p) for p in polys])]).astype(int)
+    b.poly_width = np.broadcast_to(np.asarray(width, dtype=int), (len(polys),))
+    b.poly_color = batch_colors(color, len(polys))
+    return b
+
+# arcs follow pygame.draw.arc: counter clockwise from th0 to th1, and th1 < th0
+# wraps around once
+def arc_span(th0, th1):
+    d = th1 - th0
+    return np.minimum(np.where(d < 0, d + 2 * np.pi, d), 2 * np.pi)
+
+# (lo, hi) world bounding boxes of arcs, (N, 2) each
+def arc_bounds(origin, r, th0, span):
+    u0 = np.stack([np.cos(th0), np.sin(th0)], axis=1)
+    u1 = np.stack([np.cos(th0 + span), np.sin(th0 + span)], axis=1)
+    lo = np.minimum(u0, u1)
+    hi = np.maximum(u0, u1)
+    # sweeps through +x, +y, -x, -y
+    through = (np.arange(4) * np.pi / 2 - th0[:, None]) % (2 * np.pi) <= span[:, None]
+    hi = np.where(through[:, :2], 1., hi)
+    lo = np.where(through[:, 2:], -1., lo)
+    return origin + r[:, None] * lo, origin + r[:, None] * hi
+
+# chords per arc so that none strays more than tol pixels from the arc at
+# scale pixels per meter; arcs under a pixel or so become a single chord
+def arc_segments(r, span, scale, tol=0.5, max_n=1024):
+    rp = np.maximum(r * scale, tol)
+    return np.clip(np.ceil(span / (2 * np.arccos(1 - tol / rp))), 1, max_n).astype(int)
+
+# polylines of n[i] chords each, as (points, offsets) like DrawBatch polys
+def arc_polylines(origin, r, th0, span, n):
+    offsets = np.concatenate([[0], np.cumsum(n + 1)]).astype(int)
+    i = np.repeat(np.arange(len(n)), n + 1)
+    k = np.arange(offsets[-1]) - offsets[i]
+    th = th0[i] + span[i] * k / n[i]
+    return origin[i] + r[i, None] * np.stack([np.cos(th), np.sin(th)], axis=1), offsets
+
+# adapter for the draw_*_cmd dict lists; the dict path has always drawn lines
+# and arcs 1px wide and polys filled, whatever their "width"
+def cmds_to_batch(cmds):
+    groups = {"circle": [], "lineseg": [], "arcseg": [], "poly": []}
+    for cmd in cmds:
+        groups[cmd["type"]].append(cmd)
+    bs = []
+    if groups["circle"]:
+        cs = groups["circle"]
+        bs.append(circle_batch([c["origin"] for c in cs], [c["r"] for c in cs], np.array([s2color(c.get("color")) for c in cs]), [c["width"] for c in cs]))
+    if groups["lineseg"]:
+        cs = groups["lineseg"]
+        bs.append(lineseg_batch([c["start"] for c in cs], [c["end"] for c in cs], np.array([s2color(c.get("color")) for c in cs]), 1))
+    if groups["arcseg"]:
+        cs = groups["arcseg"]
+        bs.append(arcseg_batch([c["origin"] for c in cs], [c["r"] for c in cs], [c["start"] for c in cs], [c["end"] for c in cs], np.array([s2color(c.get("color")) for c in cs]), 1))
+    if groups["poly"]:
+        cs = groups["poly"]
+        bs.append(poly_batch([c["points"] for c in cs], np.array([s2color(c.get("color")) for c in cs]), 0))
+    if len(bs) == 1:
+        return bs[0]
+    return DrawBatch.concat(bs) if bs else DrawBatch()
+
+def s2color(s):
+    if s == "white":
+        return (255, 255, 255)
+    elif s == "red":
+        return (170, 0, 0)
+    elif s == "green":
+        return (0, 170, 0)
+    elif s == "blue":
+        return (0, 0, 170)
+    elif s is None or s == "black":
+        return (0, 0, 0)
+    else:
+        return s
@@ -0,0 +1,139 @@
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+import course as course_mod
+import graphic
+import pygame
+import lt
+import recorder
+import render
+import sim
+
+# encodes frames on a background thread so rendering never waits on the disk;
+# put() only blocks once `depth` frames are queued
+class FrameWriter():
+    def __init__(self, out, size, fmt='png', depth=64):
+        self.out = out
+        self.size = tuple(size)
+        self.fmt = fmt
+        self.queue = queue.Queue(maxsize=depth)
+        self.n = 0
+        self.error = None
+        if fmt == 'png':
+            os.makedirs(out, exist_ok=True)
+            self.f = None
+        else:
+            self.f = sys.stdout.buffer if out == '-' else open(out, 'wb')
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    # frame: rgb24 bytes as returned by Viewer.frame()
+    def put(self, frame):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(frame)
+        self.n += 1
+
+    def loop(self):
+        i = 0
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            # after an error keep draining so put() never blocks forever
+            if self.error is None:
+                try:
+                    if self.fmt == 'png':
+                        surface = pygame.image.frombytes(frame, self.size, 'RGB')
+                        pygame.image.save(surface, os.path.join(self.out, f"frame{i:06d}.png"))
+                    else:
+                        self.f.write(frame)
+                except Exception as e:
+                    self.error = e
+            i += 1
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.f is not None and self.f is not sys.stdout.buffer:
+            self.f.close()
+        if self.error is not None:
+            raise self.error
+
+def render_frame(viewer, c, model, lines, follow=False):
+    if follow:
+        viewer.offset = [-viewer.scale * model.x / viewer.screen_size[0], viewer.scale * model.y / viewer.screen_size[1]]
+    viewer.clear()
+    viewer.set_static(c.version, c.draw_course)
+    viewer.draw(render.draw_model(model))
+    viewer.text(lines)
+    viewer.flush(0)
+    return viewer.frame()
+
+def export_recording(args, viewer, writer):
+    rec = recorder.Recording(args.recording)
+    c = course_mod.Course()
+    c.load(args.course or rec.meta['course'])
+    model = lt.LTModel()
+    for i in range(0, len(rec), args.stride):
+        frame = rec[i]
+        recorder.frame_to_model(frame, model)
+        writer.put(render_frame(viewer, c, model, [f"frame {i}/{len(rec)} t={frame['t']:.3f}"], args.follow))
+
+def export_sim(args, viewer, writer):
+    c = course_mod.Course()
+    c.load(args.course)
+    s = sim.Simulator(c, dt=args.dt, ref_vel_forward=args.speed)
+    s.sense()
+    for i in range(args.steps):
+        if i % args.stride == 0:
+            writer.put(render_frame(viewer, c, s.model, [f"t={s.t:.3f}"], args.follow))
+        try:
+            s.step()
+        except AssertionError:
+            print("run stopped: line lost", file=sys.stderr)
+            break
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="render recordings or headless runs offscreen to a png sequence or raw rgb24 video")
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('recording')
+    p.add_argument('recording')
+    p.add_argument('out', help="png: directory, raw: file or - for stdout")
+    p.add_argument('--course', default=None)
+    p = sub.add_parser('sim')
+    p.add_argument('course')
+    p.add_argument('out', help="png: directory, raw: file or - for stdout")
+    p.add_argument('--steps', type=int, default=3000)
+    p.add_argument('--dt', type=float, default=0.01)
+    p.add_argument('--speed', type=float, default=0.20)
+    for p in sub.choices.values():
+        p.add_argument('--format', choices=['png', 'raw'], default=None, help="default: raw for *.raw/*.rgb/-, else png")
+        p.add_argument('--stride', type=int, default=1, help="render every n-th frame/step")
+        p.add_argument('--size', type=int, nargs=2, default=[800, 600])
+        p.add_argument('--scale', type=float, default=300., help="pixels per meter")
+        p.add_argument('--follow', action='store_true', help="keep the robot centered")
+        p.add_argument('--depth', type=int, default=64, help="frames queued for the encoder")
+    args = parser.parse_args(argv)
+    fmt = args.format or ('raw' if args.out == '-' or args.out.endswith(('.raw', '.rgb')) else 'png')
+
+    viewer = graphic.Viewer(scale=args.scale, screen_size=tuple(args.size), offscreen=True)
+    writer = FrameWriter(args.out, args.size, fmt, args.depth)
+    t = time.perf_counter()
+    try:
+        if args.cmd == 'recording':
+            export_recording(args, viewer, writer)
+        else:
+            export_sim(args, viewer, writer)
+    finally:
+        writer.close()
+    dt = time.perf_counter() - t
+    print(f"{writer.n} frames -> {args.out} ({fmt}, {writer.n / dt:.1f} fps)", file=sys.stderr)
+    if fmt == 'raw':
+        print(f"e.g. ffmpeg -f rawvideo -pix_fmt rgb24 -s {args.size[0]}x{args.size[1]} -r 30 -i {args.out} out.mp4", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
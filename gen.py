@@ -0,0 +1,115 @@
+import argparse
+import time
+import numpy as np
+import course as course_mod
+
+# closed polygon zigzagging around a circle: vertex i sits at angle phi[i],
+# alternately outside and inside radius R, so it is star shaped (simple) and
+# every corner turns by roughly 2 * zigzag angle
+def star_polygon(n, rng, edge, zigzag):
+    e = rng.uniform(edge[0], edge[1], n)
+    # the inside corners turn by about 2 * beta - 2 * pi / n; keep them clearly bent
+    lo = max(zigzag[0], 1.5 * np.pi / n + 0.3)
+    beta = rng.uniform(lo, max(zigzag[1], lo + 0.1), n)
+    s = e * np.cos(beta)
+    R = s.sum() / (2 * np.pi)
+    phi = np.concatenate([[0.], np.cumsum(s[:-1])]) / R
+    rho = R + np.where(np.arange(n) % 2 == 0, 1, -1) * np.minimum(e * np.sin(beta) / 2, 0.7 * R)
+    return np.stack([rho * np.cos(phi), rho * np.sin(phi)], axis=1)
+
+def turns(ps):
+    u = np.roll(ps, -1, axis=0) - ps # edge i: ps[i] -> ps[i+1]
+    l = np.linalg.norm(u, axis=1)
+    u = u / l[:, None]
+    u_in = np.roll(u, 1, axis=0)
+    return np.arctan2(u_in[:, 0] * u[:, 1] - u_in[:, 1] * u[:, 0], (u_in * u).sum(axis=1)), u, l
+
+# largest fillet radius per corner that leaves at least `min_line` of straight
+# to the neighbouring fillets
+def fillet_room(ps, min_line):
+    turn, u, l = turns(ps)
+    return (np.minimum(l, np.roll(l, 1)) - min_line) / 2 / np.tan(np.abs(turn) / 2)
+
+# tangent points of a fillet of radius r_i at every corner, r_i drawn from
+# radius as far as the corner has room
+def fillets(ps, radius, rng, min_line):
+    turn, u, l = turns(ps)
+    u_in = np.roll(u, 1, axis=0)
+    r = rng.uniform(radius[0], np.clip(fillet_room(ps, min_line), radius[0], radius[1]))
+    t = r * np.tan(np.abs(turn) / 2)
+    return ps - t[:, None] * u_in, ps + t[:, None] * u, r
+
+# closed course of about n_segments (rounded up to a multiple of 4, at least 16):
+# straight, fillet arc, straight, ... built through the editor so every segment
+# follows the same tangent continuity rules as a hand drawn course. every
+# fillet radius lies within `radius`
+def generate(n_segments, seed=0, radius=(0.15, 0.5), edge=(0.6, 1.5), zigzag=(0.35, 0.8), min_turn=0.5, mark_density=1.0, start_mark=True):
+    rng = np.random.default_rng(seed)
+    n = max(8, 2 * ((n_segments + 3) // 4))
+    # nearly straight corners would make try_add_curve_segment fall back to a line
+    for _ in range(100):
+        ps = star_polygon(n, rng, edge, zigzag)
+        if np.abs(turns(ps)[0]).min() >= min_turn:
+            break
+    else:
+        raise ValueError(f"no polygon with corners of at least {min_turn} rad; widen zigzag")
+    # small polygons turn too sharply for their edges to hold radius[0] fillets:
+    # scale them up (edges then exceed `edge`), the room grows at least as fast
+    room = fillet_room(ps, min_line=0.05).min()
+    if room <= 0:
+        raise ValueError("edges too short for the fillets; widen edge")
+    if room < radius[0]:
+        ps = ps * (radius[0] / room * (1 + 1e-9))
+    a, b, r = fillets(ps, radius, rng, min_line=0.05)
+    if not ((r >= radius[0]) & (r <= fillet_room(ps, min_line=0.05))).all():
+        raise ValueError(f"fillets do not fit within radius {radius}")
+    c = course_mod.Course()
+    c.set_start_point(b[0])
+    for i in range(1, n):
+        c.try_add_line_segment(a[i])
+        c.append_segment()
+        c.set_start_point(None)
+        c.try_add_curve_segment(b[i])
+        c.append_segment()
+        c.set_start_point(None)
+    c.try_add_line_segment(a[0])
+    c.append_segment()
+    c.set_start_point(None)
+    c.try_close_loop_with_arc_line()
+    c.append_segment()
+    c.close_loop()
+    assert len(c.segments) == 2 * n
+    add_marks(c, rng, mark_density, start_mark)
+    return c
+
+# corner marks on the left at a random mark_density fraction of the curvature
+# changes, goal mark on the right of the start
+def add_marks(c, rng, mark_density, start_mark):
+    t = c.tables
+    ends = np.where((t.seg_type == course_mod.LINESEG)[:, None], t.line_end[t.seg_row], t.arc_end[t.seg_row])
+    dirs = np.array([seg['end-dir'] for seg in c.segments])
+    left = np.stack([-dirs[:, 1], dirs[:, 0]], axis=1)
+    pick = rng.random(len(ends)) < mark_density
+    for p in ends[pick] + c.mark_d * left[pick]:
+        c.add_mark(p)
+    if start_mark:
+        seg = c.segments[0]
+        c.add_mark(seg['start'] - c.mark_d * np.array([-seg['start-dir'][1], seg['start-dir'][0]]))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="generate random closed courses")
+    parser.add_argument('out', help=".yaml or .npz")
+    parser.add_argument('--segments', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--radius', type=float, nargs=2, default=[0.15, 0.5], help="fillet radius range [m]")
+    parser.add_argument('--edge', type=float, nargs=2, default=[0.6, 1.5], help="polygon edge length range [m]")
+    parser.add_argument('--mark-density', type=float, default=1.0, help="fraction of curvature changes with a corner mark")
+    args = parser.parse_args(argv)
+
+    t = time.perf_counter()
+    c = generate(args.segments, args.seed, tuple(args.radius), tuple(args.edge), mark_density=args.mark_density)
+    c.save(args.out)
+    print(f"{len(c.segments)} segments, {len(c.marks)} marks, {c.length():.1f} m -> {args.out} ({time.perf_counter() - t:.1f}s)")
+
+if __name__ == '__main__':
+    main()
@@ -6,27 +6,10 @@ import numpy as np
 import sys
 from pprint import pprint
 
-#-------------------------
-# Draw
-#-------------------------
-
-def draw_circle_cmd(p, r, color=None, width=0, name="-"):
-    return [{"type": "circle", "color":color, "origin":(p[0], p[1]), "r":r, "width":width, "name":name}]
-
-def draw_lineseg_cmd(p0, p1, color=None, width=1, name="-"):
-    return [{"type": "lineseg", "color":color, "start":(p0[0], p0[1]), "end":(p1[0], p1[1]), "width":width, "name":name}]
-
-def draw_arcseg_cmd(p, r, th0, th1, color=None, width=1, name="-"):
-    return [{"type": "arcseg", "color":color, "origin":(p[0], p[1]), "r":r, "start":th0, "end": th1, "width":width, "name":name}]
-
-def draw_poly_cmd(ps, color=None, width=1, name="-"):
-    return [{"type": "poly", "color":color, "points":ps, "width":width, "name":name}]
-
-def draw_eqtri_cmd(p, r, th, color=None, width=1, name="-"):
-    p0 = (p[0] + r * np.cos(th),             p[1] + r * np.sin(th))
-    p1 = (p[0] + r * np.cos(th + 2*np.pi/3), p[1] + r * np.sin(th + 2*np.pi/3))
-    p2 = (p[0] + r * np.cos(th + 4*np.pi/3), p[1] + r * np.sin(th + 4*np.pi/3))
-    return draw_poly_cmd([p0, p1, p2], color, width, name)
+# re-exported so existing graphic.draw_*_cmd callers keep working
+from drawcmd import (draw_circle_cmd, draw_lineseg_cmd, draw_arcseg_cmd, draw_poly_cmd, draw_eqtri_cmd,
+                     DrawBatch, batch_colors, circle_batch, lineseg_batch, arcseg_batch, poly_batch, cmds_to_batch, s2color)
+from drawcmd import arc_span, arc_bounds, arc_segments, arc_polylines
 
 def arr2txt(a, title=""):
     a2 = a.reshape(-1)
@@ -37,56 +20,127 @@ SCREEN_SIZE=(1500, 1200)
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 
+# arcs are drawn as chord polylines cached per zoom level (Viewer.scale)
+ARC_LOD_LEVELS = 8 # zoom levels kept
+ARC_LOD_BATCHES = 16 # arc sets kept per zoom level
+ARC_LOD_MIN = 32 # smaller arc sets (previews, robot) are not cached
+
+# the arcs of one batch at one zoom level: bounds and chord counts for all of
+# them, polylines (world coordinates, so any offset can reuse them) only once
+# an arc has been on screen
+class ArcLOD():
+    def __init__(self, b, scale):
+        self.origin = b.arc_origin
+        self.r = b.arc_r
+        self.th0 = b.arc_th0
+        self.span = arc_span(b.arc_th0, b.arc_th1)
+        self.lo, self.hi = arc_bounds(self.origin, self.r, self.th0, self.span)
+        self.n = arc_segments(self.r, self.span, scale)
+        self.lines = {}
+
+    def polylines(self, idx):
+        idx = idx.tolist()
+        todo = [i for i in idx if i not in self.lines]
+        if todo:
+            ps, off = arc_polylines(self.origin[todo], self.r[todo], self.th0[todo], self.span[todo], self.n[todo])
+            for j, i in enumerate(todo):
+                self.lines[i] = ps[off[j]:off[j + 1]]
+        return [self.lines[i] for i in idx]
+
 def default_event_handler(key, shifted):
     if key == 'q':
         sys.exit()
 
-def s2color(s):
-    if s == "white":
-        return (255, 255, 255)
-    elif s == "red":
-        return (170, 0, 0)
-    elif s == "green":
-        return (0, 170, 0)
-    elif s == "blue":
-        return (0, 0, 170)
-    elif s is None or s == "black":
-        return (0, 0, 0)
-    else:
-        return s
-
 class Viewer():
-    def __init__(self, scale=1, screen_size=SCREEN_SIZE, offset=[0, 0], cursor_show=False):
+    # offscreen: no window (SDL dummy driver), draw into a plain surface and
+    # let flush() return at once; frame() reads the pixels back
+    def __init__(self, scale=1, screen_size=SCREEN_SIZE, offset=[0, 0], cursor_show=False, offscreen=False):
+        if offscreen:
+            environ.setdefault('SDL_VIDEODRIVER', 'dummy')
         pygame.init()
         pygame.mouse.set_visible(cursor_show)
         pygame.event.clear()
         self.scale = scale
         self.screen_size = screen_size
-        self.screen = pygame.display.set_mode(self.screen_size)
+        self.offscreen = offscreen
+        self.screen = pygame.Surface(self.screen_size) if offscreen else pygame.display.set_mode(self.screen_size)
         self.offset = offset
         self.clock = pygame.time.Clock()
         self.font = pygame.font.SysFont('Calibri', 15, True, False)
         self.cursor_show = cursor_show
         self.cur_pos = None
-
+        # static layer: off-screen surface restored under the dirty rects each frame
+        self.static = None
+        self.static_key = None
+        self.dirty = []
+        self.prev_dirty = []
+        self.full_redraw = True
+        self.arc_cache = {} # scale -> {arc data bytes: ArcLOD}
+
+    # render make_cmds() into the static layer unless key, scale, offset and
+    # screen size are unchanged since the last call
+    def set_static(self, key, make_cmds):
+        key = (key, self.scale, tuple(self.offset), tuple(self.screen_size))
+        if key == self.static_key:
+            return
+        self.static_key = key
+        self.static = pygame.Surface(self.screen_size)
+        self.static.fill(WHITE)
+        self.draw(make_cmds(), surface=self.static)
+        self.screen.blit(self.static, (0, 0))
+        self.full_redraw = True
 
     def text(self, ss, color=None):
         for i, s in enumerate(ss):
             text = self.font.render(s, True, s2color(color))
-            self.screen.blit(text, [100, i*30+100])
+            self.dirty.append(self.screen.blit(text, [100, i*30+100]))
 
     def conv_pos(self, p):
         ret = self.scale * np.array([p[0], -p[1]]) + np.array(self.screen_size)/2 +  np.array([self.screen_size[0] * self.offset[0], self.screen_size[1] * self.offset[1]])
         return ret
 
+    # conv_pos over (..., 2) world points at once
+    def conv_points(self, ps):
+        size = np.array(self.screen_size, dtype=float)
+        o = size / 2 + size * np.asarray(self.offset, dtype=float)
+        ret = np.empty(np.shape(ps))
+        ret[..., 0] = self.scale * ps[..., 0] + o[0]
+        ret[..., 1] = -self.scale * ps[..., 1] + o[1]
+        return ret
+
     def rconv_pos(self, p):
         off = np.array([self.screen_size[0] * self.offset[0], self.screen_size[1] * self.offset[1]])
         ret = (np.array([p[0], p[1]]) - off - np.array(self.screen_size)/2) / self.scale
         ret[1] = -ret[1]
         return ret
 
+    # world (lo, hi) corners of the screen, grown by pad pixels
+    def view_box(self, pad=0):
+        lo = self.rconv_pos((-pad, self.screen_size[1] + pad))
+        hi = self.rconv_pos((self.screen_size[0] + pad, -pad))
+        return lo, hi
+
+    def arc_lod(self, b):
+        if len(b.arc_r) < ARC_LOD_MIN:
+            return ArcLOD(b, self.scale)
+        level = self.arc_cache.pop(self.scale, {})
+        self.arc_cache[self.scale] = level
+        if len(self.arc_cache) > ARC_LOD_LEVELS:
+            del self.arc_cache[next(iter(self.arc_cache))]
+        key = b''.join(a.tobytes() for a in (b.arc_origin, b.arc_r, b.arc_th0, b.arc_th1))
+        lod = level.pop(key, None) or ArcLOD(b, self.scale)
+        level[key] = lod
+        if len(level) > ARC_LOD_BATCHES:
+            del level[next(iter(level))]
+        return lod
+
     def clear(self):
-        self.screen.fill(WHITE)
+        if self.static is None:
+            self.screen.fill(WHITE)
+        else:
+            for r in self.prev_dirty:
+                self.screen.blit(self.static, r, r)
+        self.dirty = []
 
     def handle_event(self, handler = None):
         for event in pygame.event.get():
@@ -123,21 +177,48 @@ class Viewer():
 
 
     def draw_horizon(self, y):
-        pygame.draw.line(self.screen, BLACK, self.conv_pos((-1000,y)), self.conv_pos((1000,y)), width=int(2))
-
-    def draw(self, cmds):
-        for cmd in cmds:
-            if cmd["type"] == "lineseg":
-                pygame.draw.line(self.screen, s2color(cmd.get("color")), self.conv_pos(cmd["start"]), self.conv_pos(cmd["end"]), width=1)
-            elif cmd["type"] == "poly":
-                pygame.draw.polygon(self.screen, s2color(cmd.get("color")), [self.conv_pos(p) for p in cmd['points']], width=0)
-            elif cmd["type"] == "circle":
-                pygame.draw.circle(self.screen, s2color(cmd.get("color")), self.conv_pos(cmd["origin"]), self.scale * cmd["r"], width=cmd["width"])
-            elif cmd["type"] == "arcseg":
-                c = self.conv_pos(cmd["origin"])
-                r = self.scale * cmd["r"]
-                rect = pygame.Rect(c[0] - r, c[1] - r, 2 * r, 2 * r)
-                pygame.draw.arc(self.screen, s2color(cmd.get("color")), rect, cmd["start"], cmd["end"], width=1)
+        self.dirty.append(pygame.draw.line(self.screen, BLACK, self.conv_pos((-1000,y)), self.conv_pos((1000,y)), width=int(2)))
+
+    # draws a DrawBatch or a draw_*_cmd list onto the screen (tracking dirty
+    # rects) or onto the given surface. primitives whose bounding box misses
+    # the screen are skipped, arcs are drawn as polylines (see ArcLOD)
+    def draw(self, cmds, surface=None):
+        b = cmds if isinstance(cmds, DrawBatch) else cmds_to_batch(cmds)
+        rects = self.dirty if surface is None else []
+        surface = self.screen if surface is None else surface
+        def visible(lo, hi, width):
+            vlo, vhi = self.view_box(width.max(initial=0) + 2)
+            return np.flatnonzero(((hi >= vlo) & (lo <= vhi)).all(axis=1))
+        # one transform per primitive type, then plain python lists for pygame
+        if len(b.poly_width) > 0:
+            start = b.poly_offsets[:-1]
+            idx = visible(np.minimum.reduceat(b.poly_points, start), np.maximum.reduceat(b.poly_points, start), b.poly_width)
+            ps = self.conv_points(b.poly_points).tolist()
+            off = b.poly_offsets.tolist()
+            for i, color, width in zip(idx.tolist(), b.poly_color[idx].tolist(), b.poly_width[idx].tolist()):
+                rects.append(pygame.draw.polygon(surface, color, ps[off[i]:off[i + 1]], width=width))
+        if len(b.line_width) > 0:
+            idx = visible(np.minimum(b.line_start, b.line_end), np.maximum(b.line_start, b.line_end), b.line_width)
+            p0 = self.conv_points(b.line_start[idx]).tolist()
+            p1 = self.conv_points(b.line_end[idx]).tolist()
+            for s, e, color, width in zip(p0, p1, b.line_color[idx].tolist(), b.line_width[idx].tolist()):
+                rects.append(pygame.draw.line(surface, color, s, e, width=width))
+        if len(b.arc_r) > 0:
+            lod = self.arc_lod(b)
+            idx = visible(lod.lo, lod.hi, b.arc_width)
+            if len(idx) > 0:
+                lines = lod.polylines(idx)
+                off = np.concatenate([[0], np.cumsum([len(l) for l in lines])]).tolist()
+                ps = self.conv_points(np.concatenate(lines)).tolist()
+                for j, color, width in zip(range(len(idx)), b.arc_color[idx].tolist(), b.arc_width[idx].tolist()):
+                    rects.append(pygame.draw.lines(surface, color, False, ps[off[j]:off[j + 1]], width=width))
+        if len(b.circle_r) > 0:
+            r = b.circle_r[:, None]
+            idx = visible(b.circle_origin - r, b.circle_origin + r, b.circle_width)
+            c = self.conv_points(b.circle_origin[idx]).tolist()
+            r = (self.scale * b.circle_r[idx]).tolist()
+            for p, rr, color, width in zip(c, r, b.circle_color[idx].tolist(), b.circle_width[idx].tolist()):
+                rects.append(pygame.draw.circle(surface, color, p, rr, width=width))
 
     def flush(self, Hz):
         if not self.cursor_show:
@@ -146,9 +227,20 @@ class Viewer():
             if self.cur_pos is not None:
                 x = self.cur_pos[0]
                 y = self.cur_pos[1]
-                pygame.draw.line(self.screen, BLACK, (-lx,y), (lx,y), width=int(1))
-                pygame.draw.line(self.screen, BLACK, (x,-ly), (x,ly), width=int(1))
-        pygame.display.flip()
-        self.clock.tick(Hz)
-
-
+                self.dirty.append(pygame.draw.line(self.screen, BLACK, (-lx,y), (lx,y), width=int(1)))
+                self.dirty.append(pygame.draw.line(self.screen, BLACK, (x,-ly), (x,ly), width=int(1)))
+        if self.offscreen:
+            pass
+        elif self.static is None or self.full_redraw:
+            pygame.display.flip()
+        else:
+            pygame.display.update(self.prev_dirty + self.dirty)
+        self.prev_dirty = self.dirty
+        self.dirty = []
+        self.full_redraw = False
+        if not self.offscreen:
+            self.clock.tick(Hz)
+
+    # current screen as packed rgb24 bytes, row major
+    def frame(self):
+        return pygame.image.tobytes(self.screen, 'RGB')
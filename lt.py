@@ -1,15 +1,98 @@
 import numpy as np
+from collections import deque
 
 def normalize(v):
     l2 = np.linalg.norm(v)
     assert l2 > 0.0001
     return v/l2
 
+HISTORY_DTYPE = np.dtype([
+    ('x', 'f8'), ('y', 'f8'), ('th', 'f8'),
+    ('dx', 'f8'), ('dy', 'f8'), ('dth', 'f8'),
+    ('line_sensor', 'f8', (6, 2)),
+    ('corner_sensor', 'f8', (2,)),
+    ])
+
+# preallocated record buffer: grows by doubling, or with ring=True keeps the
+# last `capacity` records (LTModel's default, so long runs stay bounded).
+# ring records are written twice (i and i+capacity) so the live window is
+# always one contiguous slice.
+class History():
+    def __init__(self, dtype=HISTORY_DTYPE, capacity=1024, ring=False):
+        self.capacity = capacity
+        self.ring = ring
+        self.buf = np.zeros(2 * capacity if ring else capacity, dtype=dtype)
+        self.clear()
+
+    def clear(self):
+        self.start = 0
+        self.n = 0
+        self.total = 0 # appended minus popped, also counting records a ring dropped
+
+    def __len__(self):
+        return self.n
+
+    def append(self, rec):
+        if self.ring:
+            i = (self.start + self.n) % self.capacity
+            self.buf[i] = rec
+            self.buf[i + self.capacity] = rec
+            if self.n == self.capacity:
+                self.start = (self.start + 1) % self.capacity
+            else:
+                self.n += 1
+        else:
+            if self.n == len(self.buf):
+                buf = np.zeros(2 * len(self.buf), dtype=self.buf.dtype)
+                buf[:self.n] = self.buf
+                self.buf = buf
+            self.buf[self.n] = rec
+            self.n += 1
+        self.total += 1
+
+    def pop(self):
+        if self.n == 0:
+            raise IndexError("pop from empty history")
+        self.n -= 1
+        self.total -= 1
+        return self.buf[self.start + self.n]
+
+    # back to `total` records: pops while the records are still held, otherwise
+    # starts over empty (e.g. a checkpoint restored into a fresh model)
+    def truncate(self, total):
+        if total <= self.total and self.total - total <= self.n:
+            self.n -= self.total - total
+        else:
+            self.start = 0
+            self.n = 0
+        self.total = total
+
+    # zero-copy view of the recorded records, oldest first
+    def view(self):
+        return self.buf[self.start:self.start + self.n]
+
+# pose after dt at constant forward speed v and turn rate w: the exact arc of
+# radius v/w, a straight line as w -> 0. broadcasts over all arguments
+def unicycle_exact(x, y, th, v, w, dt):
+    a = w * dt / 2
+    l = v * dt * np.sinc(a / np.pi) # chord length
+    return x + l * np.cos(th + a), y + l * np.sin(th + a), th + 2 * a
+
+# trapezoidal average of the previous (dx, dy, dth) and the new velocities
+def unicycle_trapezoid(x, y, th, dx, dy, dth, v, w, dt):
+    new_dx = v * np.cos(th)
+    new_dy = v * np.sin(th)
+    return x + (new_dx + dx)/2*dt, y + (new_dy + dy)/2*dt, th + (w + dth)/2*dt
+
+INTEGRATORS = ('exact', 'trapezoid')
+
 # perfect vel tracking assumption
 class LTModel():
     # driveing-dir: x
     # left-dir : y
-    def __init__(self, wr = 0.01, d=0.1, r=0.05, lss=0.019/2, cm=0.06):
+    def __init__(self, wr = 0.01, d=0.1, r=0.05, lss=0.019/2, cm=0.06, history_capacity=4096, history_ring=True, integrator='exact'):
+        assert integrator in INTEGRATORS
+        self.integrator = integrator
         self.wr = wr # wheel radius
         self.d = d # wheel distance
         self.r = r # body size
@@ -25,6 +108,8 @@ class LTModel():
             [0,  cm, 1],
             [0,  -cm, 1]
             ])
+        # last history_capacity steps; history_ring=False keeps all of them (short analysis runs)
+        self.history = History(capacity=history_capacity, ring=history_ring)
         self.clear()
 
     def clear(self):
@@ -35,39 +120,62 @@ class LTModel():
         self.dy = 0
         self.dth = 0
         self.update_sensor_pos()
-        self.history = []
+        self.history.clear()
 
+    # wheel angular velocities [rad/s]
     def step_u(self, omega_l, omega_r, dt):
-        omega_l, omega_r = u[0], u[1]
         vl = self.wr * omega_l
         vr = self.wr * omega_r
-        v = (vl + vr) / 2
-        new_dx = v * np.cos(self.th)
-        new_dy = v * np.sin(self.th)
-        new_dth = (vr - v) / self.d
-        self.x = self.x + (new_dx + self.dx)/2*dt
-        self.y = self.y + (new_dy + self.dy)/2*dt
-        self.th = self.th + (new_dth + self.dth)/2*dt
-        self.dx = new_dx
-        self.dy = new_dy
-        self.dth = new_dth
-        self.update_sensor_pos()
+        self.step((vl + vr) / 2, (vr - vl) / self.d, dt)
+
+    # pose after step() without changing the model; dt may be an array
+    def peek(self, ref_vel_forward, ref_vel_rotate, dt):
+        if self.integrator == 'exact':
+            return unicycle_exact(self.x, self.y, self.th, ref_vel_forward, ref_vel_rotate, dt)
+        return unicycle_trapezoid(self.x, self.y, self.th, self.dx, self.dy, self.dth, ref_vel_forward, ref_vel_rotate, dt)
+
+    # world positions (..., 8, 2) of all sensors for pose(s) x, y, th
+    def sensors_at(self, x, y, th):
+        c = np.cos(th)[..., None]
+        s = np.sin(th)[..., None]
+        lx = self.sensors_local[:, 0]
+        ly = self.sensors_local[:, 1]
+        return np.stack([c * lx - s * ly + np.asarray(x)[..., None], s * lx + c * ly + np.asarray(y)[..., None]], axis=-1)
 
     def step(self, ref_vel_forward, ref_vel_rotate, dt):
         new_dx = ref_vel_forward * np.cos(self.th)
         new_dy = ref_vel_forward * np.sin(self.th)
         new_dth = ref_vel_rotate 
-        self.x = self.x + (new_dx + self.dx)/2*dt
-        self.y = self.y + (new_dy + self.dy)/2*dt
-        self.th = self.th + (new_dth + self.dth)/2*dt
+        self.x, self.y, self.th = self.peek(ref_vel_forward, ref_vel_rotate, dt)
         self.dx = new_dx
         self.dy = new_dy
         self.dth = new_dth
         self.update_sensor_pos()
-        self.history.append([self.x, self.y, self.th, self.dx, self.dy, self.dth, self.line_sensor, self.corner_sensor])
+        self.history.append((self.x, self.y, self.th, self.dx, self.dy, self.dth, self.line_sensor, self.corner_sensor))
+
+    # complete dynamic state as flat arrays, see sim.Simulator.checkpoint
+    def state(self):
+        vals = np.zeros(0, dtype=bool)
+        if hasattr(self, 'line_sensor_val'):
+            vals = np.concatenate([np.reshape(self.line_sensor_val, -1), [self.corner_sensor_val, self.goal_sensor_val]]).astype(bool)
+        return {'pose': np.array([self.x, self.y, self.th, self.dx, self.dy, self.dth], dtype=float),
+                'sensor_val': vals,
+                'history_total': np.array(self.history.total)}
+
+    def set_state(self, st):
+        self.x, self.y, self.th, self.dx, self.dy, self.dth = (float(v) for v in st['pose'])
+        if len(st['sensor_val']) > 0:
+            self.line_sensor_val = st['sensor_val'][:-2].copy()
+            self.corner_sensor_val = bool(st['sensor_val'][-2])
+            self.goal_sensor_val = bool(st['sensor_val'][-1])
+        self.history.truncate(int(st['history_total']))
+        self.update_sensor_pos()
 
     def pop(self):
-        [self.x, self.y, self.th, self.dx, self.dy, self.dth, self.line_sensor, self.corner_sensor] = self.history.pop(-1)
+        rec = self.history.pop()
+        self.x, self.y, self.th = float(rec['x']), float(rec['y']), float(rec['th'])
+        self.dx, self.dy, self.dth = float(rec['dx']), float(rec['dy']), float(rec['dth'])
+        self.update_sensor_pos()
 
     def update_sensor_pos(self):
         c = np.cos(self.th)
@@ -78,14 +186,17 @@ class LTModel():
             [ 0, 0, 1]
             ])
         sensors = (R @ self.sensors_local.T).T
+        self.sensors = sensors[:, :-1] # all 8, line sensors then corner, goal
         self.line_sensor = sensors[:-2,:-1]
         self.corner_sensor = sensors[-2,:-1]
         self.goal_sensor = sensors[-1,:-1]
 
+    # one f call for all sensors; f's fixed cost dominates at 8 points
     def observe(self, f):
-        self.line_sensor_val = f(self.line_sensor)
-        self.corner_sensor_val = f([self.corner_sensor])[0]
-        self.goal_sensor_val = f([self.goal_sensor])[0]
+        vals = np.asarray(f(self.sensors))
+        self.line_sensor_val = vals[:-2]
+        self.corner_sensor_val = vals[-2]
+        self.goal_sensor_val = vals[-1]
 
     def debug(self):
         print("model.x=", self.x)
@@ -95,31 +206,218 @@ class LTModel():
         print("model.dy=", self.dy)
         print("model.dth=", self.dth)
 
+    # drawing lives in render, loaded on first use
     def draw_model(self, model):
+        import render
+        return render.draw_model(model)
+
+
+# M robots in (M,) arrays; geometry may be given per robot
+class LTModelBatch():
+    def __init__(self, m, wr = 0.01, d=0.1, r=0.05, lss=0.019/2, cm=0.06, integrator='exact'):
+        assert integrator in INTEGRATORS
+        self.integrator = integrator
+        self.m = m
+        self.wr = np.broadcast_to(np.asarray(wr, dtype=float), (m,)).copy()
+        self.d = np.broadcast_to(np.asarray(d, dtype=float), (m,)).copy()
+        self.r = np.broadcast_to(np.asarray(r, dtype=float), (m,)).copy()
+        self.lss = np.broadcast_to(np.asarray(lss, dtype=float), (m,)).copy()
+        self.cm = np.broadcast_to(np.asarray(cm, dtype=float), (m,)).copy()
+        # same layout as LTModel.sensors_local, (M, 8, 2)
+        k = np.arange(-3, 3) + 0.5
+        line = np.stack([np.repeat(self.r[:, None], 6, axis=1), self.lss[:, None] * k], axis=2)
+        marker = np.stack([np.zeros((m, 2)), np.stack([self.cm, -self.cm], axis=1)], axis=2)
+        self.sensors_local = np.concatenate([line, marker], axis=1)
+        self.clear()
 
-        ret = graphic.draw_eqtri_cmd(np.array((model.x, model.y)), model.r, model.th, color=(122, 122, 255))
-
-        for sen, ob in zip(model.line_sensor, model.line_sensor_val):
-            ret = ret + graphic.draw_circle_cmd(sen, model.lss/2, color=(255, 0, 0) if ob else (122, 200, 40))
-        ret = ret + graphic.draw_circle_cmd(model.corner_sensor, model.lss/2, color=(255, 0, 0) if model.corner_sensor_val else (122, 200, 40))
-        ret = ret + graphic.draw_circle_cmd(model.goal_sensor, model.lss/2, color=(255, 0, 0) if model.goal_sensor_val else (122, 200, 40))
+    def clear(self):
+        self.x = np.zeros(self.m)
+        self.y = np.zeros(self.m)
+        self.th = np.zeros(self.m)
+        self.dx = np.zeros(self.m)
+        self.dy = np.zeros(self.m)
+        self.dth = np.zeros(self.m)
+        self.update_sensor_pos()
 
-        return ret
+    def step(self, ref_vel_forward, ref_vel_rotate, dt):
+        new_dx = ref_vel_forward * np.cos(self.th)
+        new_dy = ref_vel_forward * np.sin(self.th)
+        new_dth = np.broadcast_to(ref_vel_rotate, (self.m,))
+        if self.integrator == 'exact':
+            self.x, self.y, self.th = unicycle_exact(self.x, self.y, self.th, ref_vel_forward, new_dth, dt)
+        else:
+            self.x, self.y, self.th = unicycle_trapezoid(self.x, self.y, self.th, self.dx, self.dy, self.dth, ref_vel_forward, new_dth, dt)
+        self.dx = new_dx
+        self.dy = new_dy
+        self.dth = new_dth.copy()
+        self.update_sensor_pos()
 
+    def update_sensor_pos(self):
+        c = np.cos(self.th)[:, None]
+        s = np.sin(self.th)[:, None]
+        lx = self.sensors_local[..., 0]
+        ly = self.sensors_local[..., 1]
+        self.sensors = np.stack([c * lx - s * ly + self.x[:, None], s * lx + c * ly + self.y[:, None]], axis=2)
+        self.line_sensor = self.sensors[:, :-2]
+        self.corner_sensor = self.sensors[:, -2]
+        self.goal_sensor = self.sensors[:, -1]
+
+    # f maps (N, 2) points to (N,) bools, e.g. Course.sample
+    def observe(self, f):
+        vals = np.asarray(f(self.sensors.reshape(-1, 2))).reshape(self.m, -1)
+        self.line_sensor_val = vals[:, :-2]
+        self.corner_sensor_val = vals[:, -2]
+        self.goal_sensor_val = vals[:, -1]
+
+
+# last `capacity` of a growing sequence of 2d points; indexes count from the
+# first point ever appended, negative indexes from the newest
+class SampleBuffer():
+    def __init__(self, capacity=256):
+        self.buf = np.zeros((capacity, 2))
+        self.n = 0
+        self.lo = 0 # oldest index still held
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.n
+        if i < self.lo or i >= self.n:
+            raise IndexError("sample not in buffer")
+        return self.buf[i % len(self.buf)].copy()
+
+    def __repr__(self):
+        return repr(self.window())
+
+    def append(self, p):
+        self.buf[self.n % len(self.buf)] = p
+        self.n += 1
+        self.lo = max(self.lo, self.n - len(self.buf))
+
+    # inverse of window(): `points` are the held samples ending at index n
+    def restore(self, points, n):
+        self.n = n
+        self.lo = n - len(points)
+        self.buf[np.arange(self.lo, n) % len(self.buf)] = points
+
+    # held points, oldest first
+    def window(self):
+        idx = np.arange(self.lo, self.n) % len(self.buf)
+        return self.buf[idx]
+
+# running least-squares line and circle (Kasa) fit, O(1) per added point.
+# coordinates are taken relative to the first point for conditioning.
+class SegmentFit():
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.ref = None
+        self.first = None
+        self.last = None
+        self.n = 0
+        # x, y, xx, xy, yy, z, xz, yz with z = xx + yy
+        self.s = np.zeros(8)
+
+    def terms(self, p):
+        x, y = p[0] - self.ref[0], p[1] - self.ref[1]
+        z = x*x + y*y
+        return np.array([x, y, x*x, x*y, y*y, z, x*z, y*z])
+
+    def add(self, p):
+        if self.ref is None:
+            self.ref = np.array(p, dtype=float)
+            self.first = self.ref
+        self.s += self.terms(p)
+        self.n += 1
+        self.last = np.array(p, dtype=float)
+
+    # direction of the fitted line, oriented along travel
+    def heading(self):
+        if self.n < 2:
+            return None
+        sx, sy, sxx, sxy, syy = self.s[:5] / self.n
+        cxx, cxy, cyy = sxx - sx*sx, sxy - sx*sy, syy - sy*sy
+        th = 0.5 * np.arctan2(2*cxy, cxx - cyy)
+        d = np.array([np.cos(th), np.sin(th)])
+        if d @ (self.last - self.first) < 0:
+            d = -d
+        return d
+
+    # signed curvature of the fitted circle, > 0 turning left; 0 if close to straight
+    def curvature(self, max_r=100.):
+        d = self.heading()
+        if d is None or self.n < 3:
+            return 0.
+        sx, sy, sxx, sxy, syy, sz, sxz, syz = self.s
+        # collinear points leave the circle system singular
+        m = self.s[:5] / self.n
+        cxx, cxy, cyy = m[2] - m[0]*m[0], m[3] - m[0]*m[1], m[4] - m[1]*m[1]
+        if cxx*cyy - cxy*cxy <= 1e-12 * (cxx + cyy)**2:
+            return 0.
+        A = np.array([[sxx, sxy, sx], [sxy, syy, sy], [sx, sy, self.n]])
+        try:
+            D, E, F = np.linalg.solve(A, -np.array([sxz, syz, sz]))
+        except np.linalg.LinAlgError:
+            return 0.
+        c = np.array([-D/2, -E/2])
+        rr = c @ c - F
+        if rr <= 0 or rr > max_r * max_r:
+            return 0.
+        side = d[0] * (c[1] - (self.last[1] - self.ref[1])) - d[1] * (c[0] - (self.last[0] - self.ref[0]))
+        return np.sign(side) / np.sqrt(rr)
 
 class LTController():
-    def __init__(self, model, ref_vel = 0.06):
+    def __init__(self, model, ref_vel = 0.06, verbose=True, sample_capacity=256):
         self.model = model
-        self.samples = []
-        self.segment = [0] # index of samples
+        self.verbose = verbose
+        self.lost_count = 0
+        self.samples = SampleBuffer(sample_capacity)
+        self.segment = deque([0], maxlen=64) # index of samples at the last corners
+        self.fit = SegmentFit() # samples since the last corner
+        self.heading = None
+        self.curvature = 0.
         self.xi = 0.06
         self.already_reset = False
         self.I = 0
+        self.err = 0. # last heading error of pi()
+
+    # complete dynamic state as flat arrays; None fit points/heading as nan
+    def state(self):
+        def vec(v):
+            return np.full(2, np.nan) if v is None else np.asarray(v, dtype=float)
+        f = self.fit
+        return {'samples': self.samples.window().copy(),
+                'samples_n': np.array(len(self.samples)),
+                'segment': np.array(self.segment, dtype=np.int64),
+                'fit_points': np.stack([vec(f.ref), vec(f.first), vec(f.last)]),
+                'fit_n': np.array(f.n),
+                'fit_s': f.s.copy(),
+                'heading': vec(self.heading),
+                'scalars': np.array([self.curvature, self.xi, self.I, self.already_reset, self.lost_count, self.err], dtype=float)}
+
+    def set_state(self, st):
+        def vec(v):
+            return None if np.isnan(v).any() else v.copy()
+        self.samples.restore(st['samples'], int(st['samples_n']))
+        self.segment = deque(st['segment'].tolist(), maxlen=self.segment.maxlen)
+        f = self.fit
+        f.ref, f.first, f.last = (vec(p) for p in st['fit_points'])
+        f.n = int(st['fit_n'])
+        f.s = st['fit_s'].copy()
+        self.heading = vec(st['heading'])
+        curvature, xi, I, already_reset, lost_count, self.err = st['scalars'].tolist()
+        self.curvature, self.xi, self.I = curvature, xi, I
+        self.already_reset = bool(already_reset)
+        self.lost_count = int(lost_count)
 
     def check_corner(self):
         if self.model.corner_sensor_val and not self.already_reset:
             self.already_reset = True
             self.segment.append(len(self.samples))
+            self.fit.reset()
         elif not self.model.corner_sensor_val and self.already_reset:
             self.already_reset = False
 
@@ -129,20 +427,23 @@ class LTController():
             if v:
                 sens.append(self.model.line_sensor[i])
         if len(sens) < 2:
-            print("WARNING!! no line is detected!!")
+            self.lost_count += 1
+            if self.verbose:
+                print("WARNING!! no line is detected!!")
             #self.model.debug()
             return False
 
         new_pos = (sens[0] + sens[-1])/2
 
-        if len(self.samples) == 0:
-            self.samples.append(new_pos)
-        else:
+        if len(self.samples) > 0:
             delta = new_pos - self.samples[-1]
             dv = np.linalg.norm(delta)
             if dv < 0.005:
                 return False
-            self.samples.append(new_pos)
+        self.samples.append(new_pos)
+        self.fit.add(new_pos)
+        self.heading = self.fit.heading()
+        self.curvature = self.fit.curvature()
         return True
 
     # ref is always 0. Kd = 0
@@ -157,6 +458,7 @@ class LTController():
         current_dir = np.array([np.cos(self.model.th), np.sin(self.model.th)])
         err = np.cross(current_dir, target_dir)
         err = np.arcsin(err)
+        self.err = err
         self.I = self.I + err
 
         return ref_vel_forward * (Kp * err + Ki * self.I)
@@ -220,8 +522,9 @@ class LTController():
         s = np.sin(self.model.th)
         uv = self.xi + (ux * c + uy * s) * dt
         uw = (uy * c - ux * s) / uv
-        print("uv", uv, np.clip(uv, -0.4, 0.4))
-        print("uw", uw, np.clip(uw, -2.8, 2.8))
+        if self.verbose:
+            print("uv", uv, np.clip(uv, -0.4, 0.4))
+            print("uw", uw, np.clip(uw, -2.8, 2.8))
         uv = np.clip(uv, -0.4, 0.4)
         uw = np.clip(uw, -2.8, 2.8)
         self.xi = uv
@@ -231,12 +534,8 @@ class LTController():
             return uv, uw
 
     def draw_controller(self, controller):
-        ret = []
-        if len(controller.samples) <= 1:
-            return []
-        #ret = ret + graphic.draw_lineseg_cmd(controller.samples[-1], controller.samples[-1] + 500*controller.line_dir, color=(200,100, 100))
-        #ret = ret + graphic.draw_circle_cmd(np.array([model.x, model.y]), 10*controller.r, color=(200,100, 100), width=1)
-        return ret
+        import render
+        return render.draw_controller(controller)
 
 
 
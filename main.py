@@ -1,67 +1,48 @@
 import course
 import lt
 import graphic
+import render
+import sim
+import rt
+import prof
 import sys
-import numpy as np
 
 # simulation
 viewer = graphic.Viewer(scale=500)
 course = course.Course()
+if len(sys.argv) > 1:
+    course.load(sys.argv[1])
 model = lt.LTModel()
 controller = lt.LTController(model)
-
-
-ref_vel_forward = 0.0
-ref_vel_rotate = 0.0
-ref_pos = None
-mode = None
-stepFlag = False
-runFlag = True
+simulator = sim.Simulator(course, model, controller, dt=0.01, mode=None, rewind=500)
+# physics at 1/dt Hz on its own thread, rendering here at up to 60 Hz
+runner = rt.RealtimeRunner(simulator)
 
 def event_handler(key, type, args):
-    global ref_vel_forward
-    global ref_vel_rotate
-    global mode
-    global stepFlag
-    global runFlag
-    global ref_pos
     if type == 'DOWN':
         if key == 'q':
             sys.exit()
-        elif key == 'w':
-            mode = 'manual-vel'
-            ref_vel_forward = 0.06*2
-            ref_pos = None
-        elif key == 'a':
-            mode = 'manual-vel'
-            ref_vel_rotate = 0.2*4
-            ref_pos = None
-        elif key == 'd':
-            mode = 'manual-vel'
-            ref_vel_rotate = -0.2*4
-            ref_pos = None
         elif key == 's':
-            stepFlag = True
-            runFlag = True
+            runner.step_once()
         elif key == 'r':
-            runFlag ^= True
-        elif key == 'c':
-            mode = 'auto'
+            runner.paused ^= True
+        elif key == 'o':
+            # toggle profiling and its overlay
+            prof.profiler.enabled ^= True
+        elif key == 'f':
+            prof.profiler.dump()
         elif key == 'p':
-            model.debug()
-            print("ref_pos=", ref_pos)
+            # the physics thread keeps stepping; print the last consistent snapshot
+            snap = runner.snapshot()
+            for k in ['x', 'y', 'th', 'dx', 'dy', 'dth']:
+                print(f"model.{k}=", getattr(snap, k))
+            print("ref_pos=", snap.ref_pos)
         elif key == 'LB':
-            ref_pos = args
-            mode = 'manual-pos'
-        elif key == 'b':
-            model.pop()
-            controller.samples.pop(-1)
+            runner.key(key, type, args["pos"])
+        else:
+            runner.key(key, type, args)
     else:
-        ref_vel_forward = 0
-        ref_vel_rotate = 0
-
-dos = draw_course(course)
-dt = 0.01
+        runner.key(key, type, args)
 
 #model.x= 0.45075214000000036
 #model.y= 1.7411082115895215e-15
@@ -71,35 +52,26 @@ dt = 0.01
 #model.dth= 1.3824836721690708e-12
 
 
-
+runner.start()
+dropped = 0
 while True:
-    viewer.clear()
-    model.observe(course.sample)
-    viewer.draw(dos)
-    viewer.draw(draw_model(model))
-    viewer.draw(draw_controller(controller))
     viewer.handle_event(event_handler)
-
-    controller.add_sample()
-    controller.check_corner()
-
-    if runFlag:
-        if mode == 'auto':
-            #ref_pos, ref_vel, ref_acc = controller.simple(0.06, dt*100)
-            #ref_vel_forward, ref_vel_rotate = controller.pos2vel(ref_pos, ref_vel, ref_acc, dt)
-            ref_vel_forward = 0.20
-            ref_vel_rotate = controller.pi(ref_vel_forward)
-        elif mode == 'manual-pos':
-            ref_vel = np.array([0, 0])
-            ref_acc = np.array([0, 0])
-            ref_vel_forward, ref_vel_rotate = controller.pos2vel(ref_pos, ref_vel, ref_acc, dt)
-        model.step(ref_vel_forward, ref_vel_rotate, dt)
-        #model.debug()
-    if stepFlag:
-        runFlag = False
-        stepFlag = False
-
-    if ref_pos is not None:
-        viewer.draw(graphic.draw_circle_cmd(ref_pos, 0.005, color=(130,190,255)))
-    viewer.flush(30)
-
+    if runner.overloaded:
+        # physics is behind real time: give it the CPU instead of rendering
+        dropped += 1
+        viewer.clock.tick(60)
+        continue
+    snap = runner.snapshot()
+    viewer.clear()
+    with prof.phase("draw"):
+        viewer.set_static(course.version, course.draw_course)
+        viewer.draw(render.draw_model(snap))
+        viewer.draw(render.draw_controller(controller))
+        if snap.ref_pos is not None:
+            viewer.draw(graphic.draw_circle_cmd(snap.ref_pos, 0.005, color=(130,190,255)))
+    status = f"t={snap.t:.2f} rtf={runner.rtf:.2f} dropped={dropped}"
+    if runner.error is not None:
+        status += f" stopped: {runner.error!r}"
+    viewer.text([status] + (prof.profiler.report() if prof.profiler.enabled else []))
+    with prof.phase("flush"):
+        viewer.flush(60)
@@ -0,0 +1,83 @@
+import atexit
+import os
+import sys
+import time
+import numpy as np
+
+# wall time of one named phase: call count, total, and the last `keep` durations for percentiles
+class Timer():
+    __slots__ = ('name', 'calls', 'total', 'samples', 't0')
+
+    def __init__(self, name, keep):
+        self.name = name
+        self.calls = 0
+        self.total = 0.
+        self.samples = np.zeros(keep)
+        self.t0 = 0.
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        dt = time.perf_counter() - self.t0
+        self.samples[self.calls % len(self.samples)] = dt
+        self.calls += 1
+        self.total += dt
+
+    def percentiles(self, qs=(50, 99)):
+        if self.calls == 0:
+            return [0. for _ in qs]
+        return np.percentile(self.samples[:min(self.calls, len(self.samples))], qs)
+
+class NullTimer():
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+NULL_TIMER = NullTimer()
+
+class Profiler():
+    def __init__(self, enabled=False, keep=4096):
+        self.enabled = enabled
+        self.keep = keep
+        self.timers = {}
+
+    # with profiler.phase("name"): ... ; a shared no-op when disabled
+    def phase(self, name):
+        if not self.enabled:
+            return NULL_TIMER
+        t = self.timers.get(name)
+        if t is None:
+            t = self.timers[name] = Timer(name, self.keep)
+        return t
+
+    def reset(self):
+        self.timers = {}
+
+    def report(self):
+        lines = []
+        for t in sorted(self.timers.values(), key=lambda t: -t.total):
+            p50, p99 = t.percentiles()
+            lines.append(f"{t.name:14s} n={t.calls:8d} total={t.total:8.3f}s mean={t.total / max(t.calls, 1) * 1e6:9.1f}us p50={p50 * 1e6:9.1f}us p99={p99 * 1e6:9.1f}us")
+        return lines
+
+    def dump(self, f=None):
+        f = sys.stderr if f is None else f
+        for line in self.report():
+            print(line, file=f)
+
+# process-wide profiler; LT_PROFILE=1 enables it from the start
+profiler = Profiler(enabled=os.environ.get('LT_PROFILE') == '1')
+
+def phase(name):
+    return profiler.phase(name)
+
+@atexit.register
+def dump_at_exit():
+    if profiler.timers:
+        profiler.dump()
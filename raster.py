@@ -0,0 +1,141 @@
+import argparse
+import hashlib
+import json
+import os
+import numpy as np
+import course as course_mod
+
+# course rasterized into a bit-packed (rows, ceil(cols/8)) grid; a cell is set
+# when Course.sample is true at its center
+class OccupancyMap():
+    def __init__(self, bits, origin, res, shape):
+        self.bits = bits
+        self.origin = np.asarray(origin, dtype=float)
+        self.res = res
+        self.shape = tuple(shape)
+
+    def sample(self, points):
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        ij = np.floor((points - self.origin) / self.res).astype(np.int64)
+        ix, iy = ij[:, 0], ij[:, 1]
+        inside = (ix >= 0) & (iy >= 0) & (ix < self.shape[1]) & (iy < self.shape[0])
+        ix, iy = np.where(inside, ix, 0), np.where(inside, iy, 0)
+        on = (self.bits[iy, ix >> 3] >> (7 - (ix & 7))) & 1
+        return inside & (on == 1)
+
+# points covering the band of half width lw2 around each primitive, spaced by step
+def band_points(t, lw2, step):
+    for i in range(len(t.line_len)):
+        s = np.arange(-lw2, t.line_len[i] + lw2 + step, step)
+        o = np.arange(-lw2, lw2 + step, step)
+        n = np.array([-t.line_dir[i, 1], t.line_dir[i, 0]])
+        yield (t.line_start[i] + s[:, None, None] * t.line_dir[i] + o[None, :, None] * n).reshape(-1, 2)
+    for i in range(len(t.arc_r)):
+        span = (t.arc_end_th[i] - t.arc_start_th[i]) % (2 * np.pi)
+        r = np.arange(max(t.arc_r[i] - lw2, 0), t.arc_r[i] + lw2 + step, step)
+        th = t.arc_start_th[i] + np.linspace(0, span, int(np.ceil(span * r[-1] / step)) + 2)
+        u = np.stack([np.cos(th), np.sin(th)], axis=1)
+        yield (t.arc_origin[i] + r[:, None, None] * u[None, :, :]).reshape(-1, 2)
+    for i in range(len(t.mark_r)):
+        g = np.arange(-t.mark_r[i], t.mark_r[i] + step, step)
+        yield t.mark_origin[i] + np.stack(np.meshgrid(g, g), axis=2).reshape(-1, 2)
+
+# out: optional .npy path; the bits are then written straight into that memmap
+def build(course, res, out=None):
+    t = course.tables
+    pad = course.lw2 + 2 * res
+    los, his = [], []
+    if len(t.line_len) > 0:
+        los.append(np.minimum(t.line_start, t.line_end).min(axis=0))
+        his.append(np.maximum(t.line_start, t.line_end).max(axis=0))
+    if len(t.arc_r) > 0:
+        los.append((t.arc_origin - t.arc_r[:, None]).min(axis=0))
+        his.append((t.arc_origin + t.arc_r[:, None]).max(axis=0))
+    if len(t.mark_r) > 0:
+        los.append((t.mark_origin - t.mark_r[:, None]).min(axis=0))
+        his.append((t.mark_origin + t.mark_r[:, None]).max(axis=0))
+    origin = np.min(los, axis=0) - pad
+    shape = tuple(int(v) for v in (np.ceil((np.max(his, axis=0) + pad - origin) / res) + 1)[::-1])
+    packed = (shape[0], (shape[1] + 7) // 8)
+    if out is None:
+        bits = np.zeros(packed, dtype=np.uint8)
+    else:
+        bits = np.lib.format.open_memmap(out, mode='w+', dtype=np.uint8, shape=packed)
+    occ = OccupancyMap(bits, origin, res, shape)
+    # candidate cells from the bands, then the exact test at the cell centers
+    for ps in band_points(t, course.lw2 + res, res / 2):
+        ij = np.floor((ps - origin) / res).astype(np.int64)
+        ij = ij[(ij[:, 0] >= 0) & (ij[:, 1] >= 0) & (ij[:, 0] < shape[1]) & (ij[:, 1] < shape[0])]
+        lin = np.unique(ij[:, 1] * shape[1] + ij[:, 0])
+        ij = np.stack([lin % shape[1], lin // shape[1]], axis=1)
+        centers = origin + (ij + 0.5) * res
+        ij = ij[course.sample(centers, exact=True) & ~occ.sample(centers)]
+        np.bitwise_or.at(bits, (ij[:, 1], ij[:, 0] >> 3), (0x80 >> (ij[:, 0] & 7)).astype(np.uint8))
+    if out is not None:
+        bits.flush()
+    return occ
+
+def raster_path(course_path, res):
+    return f"{course_path}.occ-{res * 1e6:.0f}um.npy"
+
+# load the raster next to course_path, building it first if missing or stale;
+# the bits are memory-mapped read-only so worker processes share the pages
+def load(course, course_path, res):
+    path = raster_path(course_path, res)
+    with open(course_path, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    meta_path = path + '.json'
+    meta = None
+    if os.path.exists(path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get('sha1') != digest:
+            meta = None
+    if meta is None:
+        tmp = f"{path}.{os.getpid()}.tmp.npy"
+        occ = build(course, res, tmp)
+        del occ.bits
+        os.replace(tmp, path)
+        # meta last and also atomically: a reader sees either the old sha1 (and
+        # rebuilds) or the complete meta of the .npy already in place
+        meta = {'sha1': digest, 'origin': occ.origin.tolist(), 'res': res, 'shape': list(occ.shape)}
+        tmp = f"{meta_path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, meta_path)
+    return OccupancyMap(np.load(path, mmap_mode='r'), meta['origin'], meta['res'], meta['shape'])
+
+# mismatch rate of the raster against the exact geometry, near the line and anywhere
+def check(course, occ, n, seed=0):
+    rng = np.random.default_rng(seed)
+    t = course.tables
+    near = np.concatenate(list(band_points(t, 2 * course.lw2, occ.res)))
+    near = near[rng.integers(len(near), size=n)] + rng.uniform(-occ.res, occ.res, (n, 2))
+    lo = occ.origin
+    hi = occ.origin + np.array(occ.shape[::-1]) * occ.res
+    anywhere = rng.uniform(lo, hi, (n, 2))
+    ret = {}
+    for name, ps in [('near', near), ('anywhere', anywhere)]:
+        exact = course.sample(ps, exact=True)
+        ret[name] = float(np.mean(exact != occ.sample(ps)))
+    return ret
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="build course occupancy rasters and check them against the exact geometry")
+    parser.add_argument('course')
+    parser.add_argument('--res', type=float, nargs='+', default=[0.0005])
+    parser.add_argument('--check', type=int, default=100000, help="number of random points per check, 0 to skip")
+    args = parser.parse_args(argv)
+
+    c = course_mod.Course()
+    c.load(args.course)
+    for res in args.res:
+        occ = load(c, args.course, res)
+        line = f"res={res*1e3:.3f}mm shape={occ.shape} {os.path.getsize(raster_path(args.course, res)) / 1e6:.1f}MB"
+        if args.check > 0:
+            err = check(c, occ, args.check)
+            line += f" mismatch near={err['near']:.4%} anywhere={err['anywhere']:.4%}"
+        print(line)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+import argparse
+import json
+import os
+import numpy as np
+import course as course_mod
+import lt
+import sim
+
+FRAME_DTYPE = np.dtype([
+    ('t', 'f8'),
+    ('x', 'f8'), ('y', 'f8'), ('th', 'f8'),
+    ('dx', 'f8'), ('dy', 'f8'), ('dth', 'f8'),
+    ('sensors', 'f8', (8, 2)),
+    ('line_sensor_val', '?', (6,)),
+    ('corner_sensor_val', '?'),
+    ('goal_sensor_val', '?'),
+    ('ref_vel_forward', 'f8'),
+    ('ref_vel_rotate', 'f8'),
+    ('I', 'f8'),
+    ])
+
+MAGIC = b'LTREC001'
+HEADER_SIZE = 4096 # magic + json meta, zero padded
+
+# append-only frame file; only the chunk being written is mapped
+class Recorder():
+    def __init__(self, path, chunk=4096, meta=None):
+        self.path = path
+        self.chunk = chunk
+        meta = dict(meta or {})
+        meta['dtype'] = FRAME_DTYPE.descr
+        head = MAGIC + json.dumps(meta).encode()
+        assert len(head) <= HEADER_SIZE
+        with open(path, 'wb') as f:
+            f.write(head.ljust(HEADER_SIZE, b'\0'))
+        self.n = 0
+        self.map = None
+        self.base = 0
+
+    def next_chunk(self):
+        if self.map is not None:
+            self.map.flush()
+        self.base = self.n
+        size = HEADER_SIZE + (self.base + self.chunk) * FRAME_DTYPE.itemsize
+        with open(self.path, 'r+b') as f:
+            f.truncate(size)
+        self.map = np.memmap(self.path, dtype=FRAME_DTYPE, mode='r+', offset=HEADER_SIZE + self.base * FRAME_DTYPE.itemsize, shape=(self.chunk,))
+
+    def append(self, frame):
+        if self.map is None or self.n - self.base == self.chunk:
+            self.next_chunk()
+        self.map[self.n - self.base] = frame
+        self.n += 1
+
+    def record(self, s):
+        m = s.model
+        sensors = np.concatenate([m.line_sensor, [m.corner_sensor, m.goal_sensor]])
+        self.append((s.t, m.x, m.y, m.th, m.dx, m.dy, m.dth, sensors,
+                     m.line_sensor_val, m.corner_sensor_val, m.goal_sensor_val,
+                     s.ref_vel_forward, s.ref_vel_rotate, s.controller.I))
+
+    def close(self):
+        if self.map is not None:
+            self.map.flush()
+            self.map = None
+        with open(self.path, 'r+b') as f:
+            f.truncate(HEADER_SIZE + self.n * FRAME_DTYPE.itemsize)
+
+class Recording():
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            head = f.read(HEADER_SIZE)
+        assert head.startswith(MAGIC), f"{path} is not a recording"
+        self.meta = json.loads(head[len(MAGIC):].rstrip(b'\0'))
+        n = (os.path.getsize(path) - HEADER_SIZE) // FRAME_DTYPE.itemsize
+        self.frames = np.memmap(path, dtype=FRAME_DTYPE, mode='r', offset=HEADER_SIZE, shape=(n,)) if n > 0 else np.zeros(0, FRAME_DTYPE)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, i):
+        return self.frames[i]
+
+# set the fields LTModel.draw_model reads from one frame
+def frame_to_model(frame, model):
+    model.x, model.y, model.th = float(frame['x']), float(frame['y']), float(frame['th'])
+    model.sensors = frame['sensors']
+    model.line_sensor = frame['sensors'][:-2]
+    model.corner_sensor = frame['sensors'][-2]
+    model.goal_sensor = frame['sensors'][-1]
+    model.line_sensor_val = frame['line_sensor_val']
+    model.corner_sensor_val = frame['corner_sensor_val']
+    model.goal_sensor_val = frame['goal_sensor_val']
+
+def replay(path, course_path=None):
+    import graphic
+    import render
+    rec = Recording(path)
+    c = course_mod.Course()
+    c.load(course_path or rec.meta['course'])
+    model = lt.LTModel()
+    viewer = graphic.Viewer(scale=500, cursor_show=True)
+    state = {'i': 0, 'play': True}
+
+    # space: play/pause, left/right: -/+1 frame, down/up: -/+100 frames, home/end, 1/2: zoom
+    def event_handler(key, type, args):
+        if type != 'DOWN':
+            return
+        step = {'left': -1, 'right': 1, 'down': -100, 'up': 100}
+        if key == 'q':
+            raise SystemExit
+        elif key == 'space':
+            state['play'] = not state['play']
+        elif key in step:
+            state['i'] = state['i'] + step[key]
+        elif key == 'home':
+            state['i'] = 0
+        elif key == 'end':
+            state['i'] = len(rec) - 1
+        elif key == '1':
+            viewer.scale = viewer.scale * 2
+        elif key == '2':
+            viewer.scale = viewer.scale * 0.5
+        state['i'] = int(np.clip(state['i'], 0, len(rec) - 1))
+
+    while True:
+        viewer.clear()
+        viewer.handle_event(event_handler)
+        frame = rec[state['i']]
+        frame_to_model(frame, model)
+        viewer.set_static(c.version, c.draw_course)
+        viewer.draw(render.draw_model(model))
+        viewer.text([f"frame {state['i']}/{len(rec)} t={frame['t']:.3f}",
+                     f"v={frame['ref_vel_forward']:.3f} w={frame['ref_vel_rotate']:.3f} I={frame['I']:.3f}"])
+        viewer.flush(30)
+        if state['play'] and state['i'] < len(rec) - 1:
+            state['i'] += 1
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="record headless runs / replay recordings")
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('record')
+    p.add_argument('course')
+    p.add_argument('out')
+    p.add_argument('--steps', type=int, default=10000)
+    p.add_argument('--dt', type=float, default=0.01)
+    p.add_argument('--speed', type=float, default=0.20)
+    p = sub.add_parser('replay')
+    p.add_argument('recording')
+    p.add_argument('course', nargs='?')
+    args = parser.parse_args(argv)
+
+    if args.cmd == 'record':
+        c = course_mod.Course()
+        c.load(args.course)
+        s = sim.Simulator(c, dt=args.dt, ref_vel_forward=args.speed)
+        rec = Recorder(args.out, meta={'course': os.path.abspath(args.course), 'dt': args.dt})
+        try:
+            s.run(args.steps, recorder=rec)
+        except AssertionError:
+            print("run stopped: line lost")
+        finally:
+            rec.close()
+        print(f"{rec.n} frames -> {args.out}")
+    else:
+        replay(args.recording, args.course)
+
+if __name__ == '__main__':
+    main()
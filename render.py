@@ -0,0 +1,36 @@
+import numpy as np
+import drawcmd
+
+# draw commands for the simulation core. lt and course only import this inside
+# their draw methods, so simulating never loads any drawing code (nor pygame,
+# which only graphic.Viewer needs)
+
+def segment_cmd(o, color=None):
+    if o['type'] == 'arcseg':
+        return drawcmd.draw_arcseg_cmd(o['origin'], o['r'], o['start-th'], o['end-th'], color=color)
+    elif o['type'] == 'lineseg':
+        return drawcmd.draw_lineseg_cmd(o['start'], o['end'], color=color)
+    return []
+
+def mark_cmd(o):
+    return drawcmd.draw_circle_cmd(o['origin'], o['r'], width=0, color=(180, 180, 180))
+
+def draw_course(course):
+    return course.draw_course()
+
+# model: LTModel or anything with its pose/sensor fields (rt snapshots, replay frames)
+def draw_model(model):
+    th = model.th + np.array([0, 2*np.pi/3, 4*np.pi/3])
+    body = np.stack([model.x + model.r * np.cos(th), model.y + model.r * np.sin(th)], axis=1)
+    sensors = np.concatenate([np.reshape(model.line_sensor, (-1, 2)), [model.corner_sensor, model.goal_sensor]])
+    vals = np.concatenate([np.reshape(model.line_sensor_val, -1), [model.corner_sensor_val, model.goal_sensor_val]]).astype(bool)
+    colors = np.where(vals[:, None], [255, 0, 0], [122, 200, 40])
+    return drawcmd.poly_batch([body], color=(122, 122, 255)) + drawcmd.circle_batch(sensors, model.lss/2, color=colors)
+
+def draw_controller(controller):
+    ret = []
+    if len(controller.samples) <= 1:
+        return []
+    #ret = ret + drawcmd.draw_lineseg_cmd(controller.samples[-1], controller.samples[-1] + 500*controller.line_dir, color=(200,100, 100))
+    #ret = ret + drawcmd.draw_circle_cmd(np.array([model.x, model.y]), 10*controller.r, color=(200,100, 100), width=1)
+    return ret
@@ -0,0 +1,104 @@
+import queue
+import threading
+import time
+from types import SimpleNamespace
+import numpy as np
+
+# runs Simulator.step at 1/sim.dt Hz of wall time on its own thread; the render
+# loop reads snapshot() at its own rate and should skip frames while overloaded
+class RealtimeRunner():
+    def __init__(self, simulator, max_lag=0.05, rtf_window=1.0):
+        self.sim = simulator
+        self.rate = 1. / simulator.dt
+        self.max_lag = max_lag # seconds of physics backlog counted as overload
+        self.rtf_window = rtf_window
+        self.lock = threading.Lock()
+        self.commands = queue.SimpleQueue()
+        self.thread = None
+        self.running = False
+        self.paused = False
+        self.single_step = False
+        self.lag = 0.
+        self.rtf = 0.
+        self.error = None
+        self.snap = self.make_snapshot()
+
+    @property
+    def overloaded(self):
+        return self.lag > self.max_lag
+
+    # Simulator.key, applied on the physics thread before the next step
+    def key(self, key, type, args=None):
+        self.commands.put((key, type, args))
+
+    def step_once(self):
+        self.single_step = True
+        self.paused = False
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    def snapshot(self):
+        with self.lock:
+            return self.snap
+
+    def make_snapshot(self):
+        s = self.sim
+        m = s.model
+        return SimpleNamespace(t=s.t, x=m.x, y=m.y, th=m.th, dx=m.dx, dy=m.dy, dth=m.dth, r=m.r, lss=m.lss,
+                               line_sensor=np.array(m.line_sensor), corner_sensor=np.array(m.corner_sensor), goal_sensor=np.array(m.goal_sensor),
+                               line_sensor_val=np.array(getattr(m, 'line_sensor_val', np.zeros(6, dtype=bool))),
+                               corner_sensor_val=bool(getattr(m, 'corner_sensor_val', False)),
+                               goal_sensor_val=bool(getattr(m, 'goal_sensor_val', False)),
+                               ref_pos=s.ref_pos, mode=s.mode)
+
+    def loop(self):
+        base = time.perf_counter()
+        done = 0
+        rtf_wall, rtf_sim = base, self.sim.t
+        while self.running:
+            while not self.commands.empty():
+                self.sim.key(*self.commands.get())
+            now = time.perf_counter()
+            if self.paused:
+                try:
+                    self.sim.sense()
+                except Exception as e:
+                    self.error = e
+                with self.lock:
+                    self.snap = self.make_snapshot()
+                time.sleep(0.01)
+                base, done = now, 0
+                rtf_wall, rtf_sim = now, self.sim.t
+                self.lag = 0.
+                continue
+            due = int((now - base) * self.rate) - done
+            if due <= 0:
+                time.sleep((done + 1) / self.rate - (now - base))
+                continue
+            # physics never drops steps; a backlog only shows up as lag / rtf < 1
+            n = 1 if self.single_step else min(due, max(1, int(self.rate * 0.01)))
+            try:
+                for _ in range(n):
+                    self.sim.step()
+            except Exception as e:
+                # any failure stops the physics (not the thread), main.py shows self.error
+                self.error = e
+                self.paused = True
+            done += n
+            self.lag = (due - n) / self.rate
+            with self.lock:
+                self.snap = self.make_snapshot()
+            if self.single_step:
+                self.single_step = False
+                self.paused = True
+            if now - rtf_wall >= self.rtf_window:
+                self.rtf = (self.sim.t - rtf_sim) / (now - rtf_wall)
+                rtf_wall, rtf_sim = now, self.sim.t
@@ -0,0 +1,225 @@
+import json
+import struct
+from collections import deque
+import numpy as np
+import lt
+import prof
+
+CHECKPOINT_MAGIC = b'LTCKPT01'
+MODES = (None, 'auto', 'manual-vel', 'manual-pos')
+
+# named arrays -> magic, header length, json [name, dtype, shape] header, raw data
+def pack_state(arrays):
+    arrays = {k: np.asarray(v) for k, v in arrays.items()}
+    head = json.dumps([[k, v.dtype.str, v.shape] for k, v in arrays.items()]).encode()
+    return b''.join([CHECKPOINT_MAGIC, struct.pack('<I', len(head)), head] + [v.tobytes() for v in arrays.values()])
+
+def unpack_state(blob):
+    assert blob[:len(CHECKPOINT_MAGIC)] == CHECKPOINT_MAGIC, "not a checkpoint"
+    pos = len(CHECKPOINT_MAGIC) + 4
+    (n,) = struct.unpack('<I', blob[pos - 4:pos])
+    head = json.loads(blob[pos:pos + n])
+    pos += n
+    arrays = {}
+    for k, dtype, shape in head:
+        dtype = np.dtype(dtype)
+        size = dtype.itemsize * int(np.prod(shape))
+        arrays[k] = np.frombuffer(blob, dtype=dtype, count=size // dtype.itemsize, offset=pos).reshape(shape)
+        pos += size
+    return arrays
+
+# headless fixed-step simulation: course + model + controller, no pygame, no frame-rate cap.
+# adaptive=True: steps up to dt_max (and at most max_travel of sensor movement),
+# cut short at the first sensor line/mark edge crossing, located within event_tol
+class Simulator():
+    def __init__(self, course, model=None, controller=None, dt=0.01, ref_vel_forward=0.20, mode='auto', pi_gains=None,
+                 adaptive=False, dt_max=0.05, max_travel=0.005, event_tol=1e-5, rewind=0):
+        self.course = course
+        self.model = lt.LTModel() if model is None else model
+        self.controller = lt.LTController(self.model, verbose=False) if controller is None else controller
+        self.dt = dt
+        self.auto_vel_forward = ref_vel_forward
+        self.pi_gains = {} if pi_gains is None else pi_gains # Kp, Ki for LTController.pi
+        self.mode = mode
+        self.adaptive = adaptive
+        self.dt_max = dt_max
+        self.max_travel = max_travel
+        self.event_tol = event_tol
+        self.ref_vel_forward = 0.0
+        self.ref_vel_rotate = 0.0
+        self.ref_pos = None
+        self.t = 0.0
+        self.n = 0
+        # checkpoints of the last `rewind` steps for the 'b' key
+        self.rewind = deque(maxlen=rewind) if rewind > 0 else None
+        if len(course.segments) > 0:
+            self.reset_to_start()
+
+    def reset_to_start(self):
+        seg = self.course.segments[0]
+        self.model.clear()
+        self.model.x = seg['start'][0]
+        self.model.y = seg['start'][1]
+        self.model.th = np.arctan2(seg['start-dir'][1], seg['start-dir'][0])
+        self.model.update_sensor_pos()
+
+    # manual commands, same keys as main.py
+    def key(self, key, type, args=None):
+        if type == 'DOWN':
+            if key == 'w':
+                self.mode = 'manual-vel'
+                self.ref_vel_forward = 0.06*2
+                self.ref_pos = None
+            elif key == 'a':
+                self.mode = 'manual-vel'
+                self.ref_vel_rotate = 0.2*4
+                self.ref_pos = None
+            elif key == 'd':
+                self.mode = 'manual-vel'
+                self.ref_vel_rotate = -0.2*4
+                self.ref_pos = None
+            elif key == 'c':
+                self.mode = 'auto'
+            elif key == 'LB':
+                self.ref_pos = args
+                self.mode = 'manual-pos'
+            elif key == 'b':
+                if self.rewind:
+                    self.restore(self.rewind.pop())
+        else:
+            self.ref_vel_forward = 0
+            self.ref_vel_rotate = 0
+
+    def sense(self):
+        with prof.phase("observe"):
+            self.model.observe(self.course.sample)
+        with prof.phase("add_sample"):
+            self.controller.add_sample()
+        with prof.phase("check_corner"):
+            self.controller.check_corner()
+
+    def control(self):
+        if self.mode == 'auto':
+            self.ref_vel_forward = self.auto_vel_forward
+            with prof.phase("pi"):
+                self.ref_vel_rotate = self.controller.pi(self.ref_vel_forward, **self.pi_gains)
+        elif self.mode == 'manual-pos':
+            ref_vel = np.array([0, 0])
+            ref_acc = np.array([0, 0])
+            self.ref_vel_forward, self.ref_vel_rotate = self.controller.pos2vel(self.ref_pos, ref_vel, ref_acc, self.dt)
+
+    def act(self):
+        self.control()
+        h = self.event_step() if self.adaptive else self.dt
+        with prof.phase("step"):
+            self.model.step(self.ref_vel_forward, self.ref_vel_rotate, h)
+        self.t += h
+        self.n += 1
+
+    # step length until just past the first sensor edge crossing (or the max step),
+    # by safeguarded regula falsi on Course.clearance along the step
+    def event_step(self):
+        m = self.model
+        v, w = self.ref_vel_forward, self.ref_vel_rotate
+        speed = abs(v) + abs(w) * np.linalg.norm(m.sensors_local[:, :2], axis=1).max()
+        h = self.dt_max if speed == 0 else min(self.dt_max, self.max_travel / speed)
+        g0 = self.course.clearance(m.sensors_at(m.x, m.y, m.th))
+        g1 = self.course.clearance(m.sensors_at(*m.peek(v, w, h)))
+        k = np.nonzero((g0 >= 0) != (g1 >= 0))[0]
+        if len(k) == 0:
+            return h
+        lo, hi = np.zeros(len(k)), np.full(len(k), h)
+        glo, ghi = g0[k], g1[k]
+        while (hi - lo).max() > self.event_tol:
+            finite = np.isfinite(glo) & np.isfinite(ghi)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                tm = np.where(finite, lo - glo * (hi - lo) / (ghi - glo), (lo + hi) / 2)
+            tm = np.clip(tm, lo + 0.1 * (hi - lo), hi - 0.1 * (hi - lo))
+            gm = self.course.clearance(m.sensors_at(*m.peek(v, w, tm))[np.arange(len(k)), k])
+            same = (gm >= 0) == (glo >= 0)
+            lo, glo = np.where(same, tm, lo), np.where(same, gm, glo)
+            hi, ghi = np.where(same, hi, tm), np.where(same, ghi, gm)
+        return hi.min()
+
+    def step(self):
+        if self.rewind is not None:
+            self.rewind.append(self.checkpoint())
+        self.sense()
+        self.act()
+
+    # complete model/controller/simulator state as a blob; configuration (dt,
+    # gains, speed, adaptive settings) is not included, so a checkpoint can
+    # warm-start runs with other settings. the course is only identified by digest
+    def checkpoint(self):
+        arrays = {'course_digest': np.frombuffer(self.course.digest(), dtype=np.uint8),
+                  'sim': np.array([self.t, self.n, MODES.index(self.mode), self.ref_vel_forward, self.ref_vel_rotate], dtype=float),
+                  'ref_pos': np.full(2, np.nan) if self.ref_pos is None else np.asarray(self.ref_pos, dtype=float)}
+        for k, v in self.model.state().items():
+            arrays['model.' + k] = v
+        for k, v in self.controller.state().items():
+            arrays['controller.' + k] = v
+        return pack_state(arrays)
+
+    def restore(self, blob):
+        arrays = unpack_state(blob)
+        assert arrays['course_digest'].tobytes() == self.course.digest(), "checkpoint is for another course"
+        t, n, mode, self.ref_vel_forward, self.ref_vel_rotate = arrays['sim'].tolist()
+        self.t, self.n, self.mode = t, int(n), MODES[int(mode)]
+        self.ref_pos = None if np.isnan(arrays['ref_pos']).any() else arrays['ref_pos'].copy()
+        self.model.set_state({k[6:]: v for k, v in arrays.items() if k.startswith('model.')})
+        self.controller.set_state({k[11:]: v for k, v in arrays.items() if k.startswith('controller.')})
+
+    # run n steps or until until(sim) is true; returns rows of [t, x, y, th, v, w]
+    # recorder: optional recorder.Recorder, fed every step
+    def run(self, n=None, until=None, recorder=None):
+        traj = []
+        while n is None or len(traj) < n:
+            self.step()
+            if recorder is not None:
+                recorder.record(self)
+            m = self.model
+            traj.append([self.t, m.x, m.y, m.th, self.ref_vel_forward, self.ref_vel_rotate])
+            if until is not None and until(self):
+                break
+        return np.array(traj).reshape(-1, 6)
+
+# steps both simulators; False once a step lost the line
+def advance(s, n):
+    try:
+        for _ in range(n):
+            s.step()
+    except AssertionError:
+        return False
+    return True
+
+def diverged(a, b, ok_a, ok_b, tol):
+    if ok_a != ok_b:
+        return True
+    pa = np.array([a.model.x, a.model.y, a.model.th])
+    pb = np.array([b.model.x, b.model.y, b.model.th])
+    return bool(np.abs(pa - pb).max() > tol)
+
+# a and b start in the same state (e.g. restored from one checkpoint) and differ
+# in configuration or code. runs both for up to n steps, checkpointing every
+# `every`, and bisects inside the first diverged interval; returns the number of
+# steps after which the poses first differ by more than tol, or None.
+# with tol=0 a difference never goes away again; with tol > 0 a deviation
+# that has recovered by the end of an interval is not seen
+def bisect_divergence(a, b, n, every=100, tol=0.):
+    done = 0
+    while done < n:
+        ca, cb = a.checkpoint(), b.checkpoint()
+        k = min(every, n - done)
+        if diverged(a, b, advance(a, k), advance(b, k), tol):
+            lo, hi = 0, k # in sync after lo steps, diverged after hi
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                a.restore(ca)
+                b.restore(cb)
+                if diverged(a, b, advance(a, mid), advance(b, mid), tol):
+                    hi = mid
+                else:
+                    lo = mid
+            return done + hi
+        done += k
+    return None
@@ -0,0 +1,111 @@
+import argparse
+import csv
+import itertools
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import course as course_mod
+import raster
+import sim
+
+FIELDS = ['course', 'kp', 'ki', 'speed', 'lap', 'lap_time', 'max_xte', 'lost_events', 'steps']
+
+# one course per path per worker process
+_courses = {}
+_checkpoints = {}
+
+def load_course(path, res=None):
+    if path not in _courses:
+        c = course_mod.Course()
+        c.load(path)
+        if res is not None:
+            c.raster = raster.load(c, path, res)
+        _courses[path] = c
+    return _courses[path]
+
+def load_checkpoint(path):
+    if path not in _checkpoints:
+        with open(path, 'rb') as f:
+            _checkpoints[path] = f.read()
+    return _checkpoints[path]
+
+# lap: back within lap_tol of the start after covering at least half the course.
+# with a checkpoint, every run warm-starts from it and "start" is its pose
+def run_one(job):
+    path, kp, ki, speed, dt, t_max, lap_tol, lost_limit, res, ckpt = job
+    c = load_course(path, res)
+    s = sim.Simulator(c, dt=dt, ref_vel_forward=speed, pi_gains={'Kp': kp, 'Ki': ki})
+    if ckpt is not None:
+        s.restore(load_checkpoint(ckpt))
+    start = np.array([s.model.x, s.model.y])
+    half = c.length() / 2
+    travelled = 0.0
+    max_xte = 0.0
+    lap_time = float('nan')
+    lost = 0
+    prev = start
+    while s.t < t_max:
+        n_lost = s.controller.lost_count
+        try:
+            s.step()
+        except AssertionError:
+            break
+        lost = lost + 1 if s.controller.lost_count > n_lost else 0
+        if lost > lost_limit:
+            break
+        pos = np.array([s.model.x, s.model.y])
+        travelled += np.linalg.norm(pos - prev)
+        prev = pos
+        max_xte = max(max_xte, c.distance(pos)[0])
+        if travelled > half and np.linalg.norm(pos - start) < lap_tol:
+            lap_time = s.t
+            break
+    return {'course': path, 'kp': kp, 'ki': ki, 'speed': speed,
+            'lap': not np.isnan(lap_time), 'lap_time': lap_time, 'max_xte': max_xte,
+            'lost_events': s.controller.lost_count, 'steps': s.n}
+
+def make_jobs(args):
+    if args.random > 0:
+        rng = np.random.default_rng(args.seed)
+        def pick(vs):
+            return float(rng.uniform(min(vs), max(vs)))
+        params = [(args.courses[rng.integers(len(args.courses))], pick(args.kp), pick(args.ki), pick(args.speed)) for _ in range(args.random)]
+    else:
+        params = itertools.product(args.courses, args.kp, args.ki, args.speed)
+    return [(path, kp, ki, speed, args.dt, args.t_max, args.lap_tol, args.lost_limit, args.raster, args.checkpoint) for path, kp, ki, speed in params]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="sweep LTController.pi gains and speeds over courses")
+    parser.add_argument('courses', nargs='+')
+    parser.add_argument('--kp', type=float, nargs='+', default=[10])
+    parser.add_argument('--ki', type=float, nargs='+', default=[1.15])
+    parser.add_argument('--speed', type=float, nargs='+', default=[0.20])
+    parser.add_argument('--random', type=int, default=0, help="sample N points uniformly in [min, max] of each list instead of the grid")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dt', type=float, default=0.01)
+    parser.add_argument('--t-max', type=float, default=120.)
+    parser.add_argument('--lap-tol', type=float, default=0.05)
+    parser.add_argument('--lost-limit', type=int, default=100, help="give up after this many consecutive steps without line")
+    parser.add_argument('--raster', type=float, default=None, help="sample sensors from an occupancy raster with this cell size [m]")
+    parser.add_argument('--checkpoint', default=None, help="Simulator.checkpoint() blob to warm-start every run from")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunksize', type=int, default=4)
+    parser.add_argument('--out', default='-')
+    args = parser.parse_args(argv)
+
+    jobs = make_jobs(args)
+    if args.raster is not None:
+        # build the shared raster files once before the workers map them
+        for path in args.courses:
+            load_course(path, args.raster)
+    f = sys.stdout if args.out == '-' else open(args.out, 'w', newline='')
+    writer = csv.DictWriter(f, fieldnames=FIELDS)
+    writer.writeheader()
+    with ProcessPoolExecutor(max_workers=args.workers) as ex:
+        for row in ex.map(run_one, jobs, chunksize=args.chunksize):
+            writer.writerow(row)
+    if f is not sys.stdout:
+        f.close()
+
+if __name__ == '__main__':
+    main()
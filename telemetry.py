@@ -0,0 +1,248 @@
+import argparse
+import asyncio
+import json
+import os
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+import numpy as np
+import course as course_mod
+import sim
+
+# one frame per sim step, little endian, no padding
+FRAME_DTYPE = np.dtype([
+    ('t', '<f8'),
+    ('n', '<u8'),
+    ('x', '<f8'), ('y', '<f8'), ('th', '<f8'),
+    ('ref_vel_forward', '<f8'),
+    ('ref_vel_rotate', '<f8'),
+    ('err', '<f8'),
+    ('I', '<f8'),
+    ('sensor_bits', '<u1'), # bit i: line sensor i (0..5), 6: corner, 7: goal
+    ('mode', '<u1'), # index into sim.MODES
+    ])
+
+MAGIC = b'LTTM'
+VERSION = 1
+# after the hello (MAGIC, u32 length, json meta) every message is a batch:
+# u32 frame count, u32 frames dropped for this client so far, the frames
+BATCH_HEAD = struct.Struct('<II')
+SENSOR_WEIGHTS = 1 << np.arange(8)
+POS_MAX = 1e3 # [m] bound on LB targets; far beyond any course, small enough for pos2vel
+
+class Client():
+    def __init__(self, queue_size):
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+# publishes frames to any number of socket clients from an asyncio loop on its
+# own thread. the sim side (record) only fills a preallocated batch and hands
+# full batches over without waiting; a client that can't keep up loses its
+# oldest queued batches. lines sent by clients ("w", "a UP", "LB DOWN x y",
+# "c", ...) are passed to Simulator.key on the sim thread
+class TelemetryServer():
+    def __init__(self, path=None, host='127.0.0.1', port=0, batch=16, queue_size=64):
+        self.path = path
+        self.host = host
+        self.port = port
+        self.batch = batch
+        self.queue_size = queue_size
+        self.buf = np.zeros(batch, dtype=FRAME_DTYPE)
+        self.k = 0
+        self.clients = set()
+        self.commands = queue.SimpleQueue()
+        self.loop = None
+        self.thread = None
+        self.ready = threading.Event()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run_loop, daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        return self
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+
+    def run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        if self.path is not None:
+            server = self.loop.run_until_complete(asyncio.start_unix_server(self.handle, path=self.path))
+        else:
+            server = self.loop.run_until_complete(asyncio.start_server(self.handle, self.host, self.port))
+            self.port = server.sockets[0].getsockname()[1]
+        self.ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            server.close()
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+            if self.path is not None and os.path.exists(self.path):
+                os.unlink(self.path)
+
+    # sim thread: same interface as recorder.Recorder, e.g. Simulator.run(recorder=server)
+    def record(self, s):
+        while not self.commands.empty():
+            s.key(*self.commands.get())
+        m = s.model
+        c = s.controller
+        vals = getattr(m, 'line_sensor_val', None)
+        bits = 0
+        if vals is not None:
+            bits = int(np.dot(np.concatenate([np.reshape(vals, -1), [m.corner_sensor_val, m.goal_sensor_val]]), SENSOR_WEIGHTS))
+        self.buf[self.k] = (s.t, s.n, m.x, m.y, m.th, s.ref_vel_forward, s.ref_vel_rotate, c.err, c.I, bits, sim.MODES.index(s.mode))
+        self.k += 1
+        if self.k == self.batch:
+            self.flush()
+
+    def flush(self):
+        if self.k > 0 and self.clients:
+            self.loop.call_soon_threadsafe(self.broadcast, self.k, self.buf[:self.k].tobytes())
+        self.k = 0
+
+    def broadcast(self, n, data):
+        for client in self.clients:
+            if client.queue.full():
+                client.dropped += client.queue.get_nowait()[0]
+            client.queue.put_nowait((n, data))
+
+    async def handle(self, reader, writer):
+        client = Client(self.queue_size)
+        meta = json.dumps({'version': VERSION, 'dtype': FRAME_DTYPE.descr, 'modes': sim.MODES, 'batch': self.batch}).encode()
+        writer.write(MAGIC + struct.pack('<I', len(meta)) + meta)
+        self.clients.add(client)
+        sender = asyncio.ensure_future(self.send(client, writer))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                cmd = parse_command(line.decode(errors='replace'))
+                if cmd is not None:
+                    self.commands.put(cmd)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.clients.discard(client)
+            sender.cancel()
+            writer.close()
+
+    async def send(self, client, writer):
+        try:
+            while True:
+                n, data = await client.queue.get()
+                writer.write(BATCH_HEAD.pack(n, client.dropped) + data)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+# "<key> [DOWN|UP] [x y]" -> Simulator.key arguments; x y only for LB.
+# client input: anything the sim can't take (LB without x y within POS_MAX) is None
+def parse_command(line):
+    parts = line.split()
+    if not parts:
+        return None
+    key = parts[0]
+    type = parts[1].upper() if len(parts) > 1 else 'DOWN'
+    args = None
+    if key == 'LB' and type == 'DOWN':
+        if len(parts) != 4:
+            return None
+        try:
+            args = np.array([float(parts[2]), float(parts[3])])
+        except ValueError:
+            return None
+        if not (np.abs(args) <= POS_MAX).all():
+            return None
+    return key, type, args
+
+# blocking client: yields (frames, dropped) per batch
+def connect(path=None, host='127.0.0.1', port=None):
+    if path is not None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+    else:
+        sock = socket.create_connection((host, port))
+    f = sock.makefile('rwb')
+    head = f.read(len(MAGIC) + 4)
+    assert head[:len(MAGIC)] == MAGIC, "not a telemetry stream"
+    meta = json.loads(f.read(struct.unpack('<I', head[len(MAGIC):])[0]))
+    assert meta['version'] == VERSION
+    return sock, f, meta
+
+def read_batches(f):
+    while True:
+        head = f.read(BATCH_HEAD.size)
+        if len(head) < BATCH_HEAD.size:
+            return
+        n, dropped = BATCH_HEAD.unpack(head)
+        yield np.frombuffer(f.read(n * FRAME_DTYPE.itemsize), dtype=FRAME_DTYPE), dropped
+
+def serve(args):
+    c = course_mod.Course()
+    c.load(args.course)
+    s = sim.Simulator(c, dt=args.dt, ref_vel_forward=args.speed)
+    # whole sim state (controller included) to restart from when the line is lost
+    start = s.checkpoint()
+    server = TelemetryServer(args.socket, port=args.port, batch=args.batch).start()
+    print(f"serving on {args.socket or f'127.0.0.1:{server.port}'}", file=sys.stderr)
+    t0 = time.perf_counter()
+    steps = 0
+    try:
+        while args.steps is None or steps < args.steps:
+            try:
+                s.step()
+            except AssertionError:
+                print("line lost, restarting", file=sys.stderr)
+                s.restore(start)
+                t0 = time.perf_counter()
+            steps += 1
+            server.record(s)
+            if args.realtime:
+                ahead = s.t - (time.perf_counter() - t0)
+                if ahead > 0:
+                    time.sleep(ahead)
+    finally:
+        server.flush()
+        server.stop()
+
+def watch(args):
+    sock, f, meta = connect(args.socket, port=args.port)
+    for cmd in args.send:
+        f.write(cmd.encode() + b'\n')
+    f.flush()
+    for frames, dropped in read_batches(f):
+        fr = frames[-1]
+        print(f"t={fr['t']:8.3f} x={fr['x']:7.3f} y={fr['y']:7.3f} th={fr['th']:7.3f} v={fr['ref_vel_forward']:.2f} w={fr['ref_vel_rotate']:6.2f} "
+              f"err={fr['err']:6.3f} I={fr['I']:7.3f} sensors={fr['sensor_bits']:08b} mode={meta['modes'][fr['mode']]} dropped={dropped}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="stream headless sim telemetry over a local socket / watch a stream")
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('serve')
+    p.add_argument('course')
+    p.add_argument('--steps', type=int, default=None)
+    p.add_argument('--dt', type=float, default=0.01)
+    p.add_argument('--speed', type=float, default=0.20)
+    p.add_argument('--batch', type=int, default=16, help="frames per message")
+    p.add_argument('--realtime', action='store_true', help="pace the sim to wall time")
+    p = sub.add_parser('watch')
+    p.add_argument('--send', nargs='*', default=[], help="commands to send first, e.g. 'w' 'a UP' 'c'")
+    for p in sub.choices.values():
+        p.add_argument('--socket', default=None, help="unix socket path (default: tcp on localhost)")
+        p.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args(argv)
+    serve(args) if args.cmd == 'serve' else watch(args)
+
+if __name__ == '__main__':
+    main()
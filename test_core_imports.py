@@ -0,0 +1,14 @@
+import os
+import subprocess
+import sys
+import pytest
+
+# modules that must import without pygame: simulation core, cli tools, workers
+CORE_MODULES = ['course', 'lt', 'sim', 'gen', 'raster', 'recorder', 'sweep', 'rt', 'prof', 'render', 'drawcmd', 'telemetry']
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# fresh interpreter per module so nothing imported earlier hides a pygame import
+@pytest.mark.parametrize('module', CORE_MODULES)
+def test_no_pygame(module):
+    code = f"import sys; import {module}; assert 'pygame' not in sys.modules, '{module} loads pygame'"
+    subprocess.run([sys.executable, '-c', code], cwd=HERE, check=True)
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+import course as course_mod
+import gen
+
+# brute force reference straight from the segment/mark dicts: every point
+# against every segment with the per-point check_on_* tests, no tables, no grid
+def reference_sample(c, points):
+    ret = np.zeros(len(points), dtype=bool)
+    for seg in c.segments:
+        if seg['type'] == 'lineseg':
+            start, end = np.asarray(seg['start']), np.asarray(seg['end'])
+            l = np.linalg.norm(end - start)
+            ret |= course_mod.check_on_lines(points, start, (end - start) / l, l, c.lw2)
+        else:
+            ret |= course_mod.check_on_arcs(points, np.asarray(seg['origin']), seg['r'], c.lw2, seg['start-th'], seg['end-th'])
+    for mark in c.marks:
+        ret |= course_mod.check_on_circles(points, np.asarray(mark['origin']), mark['r'])
+    return ret
+
+def reference_distance(c, points):
+    ret = np.full(len(points), np.inf)
+    for seg in c.segments:
+        if seg['type'] == 'lineseg':
+            start, end = np.asarray(seg['start']), np.asarray(seg['end'])
+            l = np.linalg.norm(end - start)
+            d = course_mod.distance_lines(points, start, (end - start) / l, l)
+        else:
+            d = course_mod.distance_arcs(points, np.asarray(seg['origin']), seg['r'], seg['start-th'], seg['end-th'],
+                                         np.asarray(seg['start']), np.asarray(seg['end']))
+        ret = np.minimum(ret, d)
+    return ret
+
+# points on, near and far from the course, plus the mark centers
+def probe_points(c, n=4000, seed=0):
+    rng = np.random.default_rng(seed)
+    ends = np.array([seg['end'] for seg in c.segments])
+    marks = np.array([m['origin'] for m in c.marks]).reshape(-1, 2)
+    near = ends[rng.integers(len(ends), size=n)] + rng.normal(0, 4 * c.lw2, (n, 2))
+    lo, hi = ends.min(axis=0) - 1, ends.max(axis=0) + 1
+    return np.concatenate([near, marks, rng.uniform(lo, hi, (n // 4, 2))])
+
+def check(c, points):
+    assert (c.sample(points) == reference_sample(c, points)).all()
+    np.testing.assert_allclose(c.distance(points), reference_distance(c, points), rtol=0, atol=1e-12)
+
+# distance only uses the grid above course.DISTANCE_SCAN_MAX segments
+@pytest.fixture(scope='module', params=[40, 600])
+def generated(request):
+    return gen.generate(request.param, seed=2)
+
+def test_sample_matches_reference(generated):
+    check(generated, probe_points(generated))
+
+def test_undo_redo_keeps_index(generated):
+    c = generated
+    points = probe_points(c, seed=1)
+    for _ in range(5):
+        c.undo()
+    check(c, points)
+    for _ in range(3):
+        c.redo()
+    check(c, points)
+    for _ in range(2):
+        c.redo()
+    check(c, points)
+
+def test_close_loop_keeps_index():
+    c = gen.generate(40, seed=3)
+    c.undo()
+    c.set_start_point(None)
+    c.try_close_loop_with_arc_line()
+    c.append_segment()
+    c.close_loop()
+    check(c, probe_points(c, seed=2))
+
+@pytest.mark.parametrize('ext', ['yaml', 'npz'])
+def test_round_trip(generated, tmp_path, ext):
+    path = str(tmp_path / f"course.{ext}")
+    generated.save(path)
+    c = course_mod.Course()
+    c.load(path, use_cache=False)
+    points = probe_points(generated, seed=3)
+    check(c, points)
+    assert (c.sample(points) == generated.sample(points)).all()
+    # editing a loaded course goes through the same incremental index
+    c.undo()
+    check(c, points)
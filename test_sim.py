@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+import gen
+import sim
+
+@pytest.fixture(scope='module')
+def generated():
+    return gen.generate(40, seed=2)
+
+def warm(c, n=300, **kw):
+    s = sim.Simulator(c, **kw)
+    s.run(n=n)
+    return s
+
+def test_restore_is_exact(generated):
+    s = warm(generated)
+    blob = s.checkpoint()
+    ref = s.run(n=500)
+    fresh = sim.Simulator(generated)
+    fresh.restore(blob)
+    assert np.array_equal(fresh.run(n=500), ref)
+    # and into the simulator it came from
+    s.restore(blob)
+    assert np.array_equal(s.run(n=500), ref)
+    assert s.checkpoint() == fresh.checkpoint()
+
+def test_restore_rejects_other_course(generated):
+    blob = warm(generated, n=10).checkpoint()
+    other = sim.Simulator(gen.generate(40, seed=3))
+    with pytest.raises(AssertionError):
+        other.restore(blob)
+
+# first step count after which the poses differ, one step at a time
+def first_divergence(a, b, n):
+    for i in range(1, n + 1):
+        ok_a, ok_b = sim.advance(a, 1), sim.advance(b, 1)
+        if sim.diverged(a, b, ok_a, ok_b, 0.):
+            return i
+    return None
+
+@pytest.mark.parametrize('every', [100, 7])
+def test_bisect_divergence_matches_brute_force(generated, every):
+    blob = warm(generated).checkpoint()
+    def pair(kp):
+        a = sim.Simulator(generated)
+        b = sim.Simulator(generated, pi_gains={'Kp': kp})
+        a.restore(blob)
+        b.restore(blob)
+        return a, b
+    expected = first_divergence(*pair(10.0001), 2000)
+    assert expected is not None
+    assert sim.bisect_divergence(*pair(10.0001), 2000, every=every) == expected
+    # identical configurations never diverge
+    assert sim.bisect_divergence(*pair(10), 500, every=every) is None